@@ -0,0 +1,13 @@
+"""Common fixtures of vartools tests."""
+
+import pytest
+
+import vartools.parser.cache as vtpc
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep cache of every test in its own temporary directory."""
+    path = tmp_path / 'cache'
+    monkeypatch.setenv(vtpc.CACHE_DIR_VARIABLE, str(path))
+    return path
@@ -0,0 +1,2 @@
+#: Version of the package, stored with cached data.
+__version__ = '0.1.0'
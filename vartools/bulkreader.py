@@ -0,0 +1,330 @@
+"""Bulk decoding of trace records into NumPy arrays.
+
+Instead of producing one :class:`~vartools.common.TraceMessage` per
+record, the functions in this module walk record boundaries of a
+large chunk of trace data once and describe all complete records with
+a single structured array. POD payloads and payloads of types described
+by structures are then decoded per ``(type_id, size)`` group with NumPy
+and collated into columns per message id by :func:`collate_records`.
+"""
+
+# pylint: disable=E1101
+
+import logging
+import struct
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+import vartools.common as vtc
+import vartools.messageutils as vtmu
+
+#: Number of bytes read from a stream per batch.
+DEFAULT_BATCH_SIZE = 1 << 24
+
+#: Description of records found in a buffer, ``offset`` points to data.
+RECORD_DTYPE = np.dtype([('timestamp', np.uint32), ('size', np.uint16),
+                         ('message_id', np.uint8), ('type_id', np.uint8),
+                         ('offset', np.int64)])
+
+#: Data buffer together with records that were found in it.
+RecordBatch = namedtuple('RecordBatch', 'buffer records')
+
+#: Map struct format characters onto NumPy type characters.
+_FORMAT_DTYPE_DICT = {'c': 'S1'}
+
+_logger = logging.getLogger(__name__)
+
+
+def _header_dtype(endianess):
+    """Return dtype of a serialized header."""
+    return np.dtype([(name, endianess + field_format)
+                     for name, field_format in vtc.HEADER_STRUCTURE])
+
+
+def pod_dtype(type_id, is_little=True):
+    """Return NumPy dtype of a POD type or None for custom types.
+
+    :param int type_id: trace type id
+    :param bool is_little: encoding of data, little or big endian.
+    """
+    if type_id not in vtc.TYPE_ID_FORMAT_DICT:
+        return None
+    type_format = vtc.TYPE_ID_FORMAT_DICT[type_id]
+    type_format = _FORMAT_DTYPE_DICT.get(type_format, type_format)
+    return np.dtype(('<' if is_little else '>') + type_format)
+
+
+def _value_dtype(type_id, type_desc_dict, is_little):
+    """Return dtype of values of a type or None if it is not known.
+
+    Types described by structures take precedence over POD types, as in
+    :class:`~vartools.messageutils.DecoderRegistry`, and a dtype is
+    only returned if its item size is the size of the structure.
+    """
+    type_desc = type_desc_dict.get(type_id)
+    if not type_desc or not type_desc.struct_object:
+        return pod_dtype(type_id, is_little)
+    dtype = type_desc.dtype
+    if dtype is None:
+        try:
+            dtype = np.dtype(type_desc.struct_object.format)
+        except TypeError:
+            return None
+    if dtype.shape or dtype.itemsize != type_desc.struct_object.size:
+        return None
+    return dtype
+
+
+def _gather_rows(data, offsets, size):
+    """Copy ``size`` bytes that start at every offset into rows.
+
+    Rows are selected from a strided view that has a window starting at
+    every byte of data, so only a single index per row is created.
+
+    :param numpy.ndarray data: bytes of trace data
+    :param numpy.ndarray offsets: offsets of rows, must not be empty
+    :rtype: numpy.ndarray of shape ``(len(offsets), size)``
+    """
+    return np.lib.stride_tricks.sliding_window_view(data, size)[offsets]
+
+
+def scan_records(buffer, endianess=None, start=0, end=None, final=True):
+    """Find all complete records in a buffer.
+
+    Only the ``size`` field is unpacked while walking the buffer, the
+    rest of the header fields are extracted with a single gather
+    operation afterwards.
+
+    :param buffer: object supporting buffer protocol with trace data
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param int start: offset of the first record
+    :param int end: offset after the last byte of trace data
+    :param bool final: if False a record without trailing padding is
+        considered incomplete, set to True at the end of trace
+    :return: records array and offset after the last complete record
+    :rtype: (numpy.ndarray, int)
+    """
+    endianess = endianess if endianess else vtc.DEFAULT_ENDIANESS
+    end = len(buffer) if end is None else end
+    size_struct = struct.Struct(endianess + 'H')
+    size_offset = struct.calcsize(endianess + vtc.HEADER_FORMAT[0])
+    header_size = vtc.HEADER_SIZE
+    # padding_size() inlined, it is called for every record
+    alignment_mask = vtc.ALIGNMENT_SIZE - 1
+    unpack_from = size_struct.unpack_from
+    positions = array('q')
+    append = positions.append
+    position = start
+    while position + header_size <= end:
+        size = unpack_from(buffer, position + size_offset)[0]
+        data_end = position + header_size + size
+        next_position = data_end + (-size & alignment_mask)
+        if next_position > end:
+            if data_end > end or not final:
+                break
+            next_position = end
+        append(position)
+        position = next_position
+    return gather_records(buffer, np.frombuffer(positions, dtype=np.int64),
+                          endianess), position
+
+
+def gather_records(buffer, positions, endianess=None):
+    """Describe records with headers at known offsets.
+
+    :param buffer: object supporting buffer protocol with trace data
+    :param positions: offsets of record headers, e.g. offsets stored in
+        :class:`~vartools.traceindex.TraceIndex`
+    :param str endianess: endianess string (see :mod:`struct`).
+    :rtype: numpy.ndarray of :const:`RECORD_DTYPE`
+    """
+    endianess = endianess if endianess else vtc.DEFAULT_ENDIANESS
+    positions = np.asarray(positions, dtype=np.int64)
+    records = np.empty(len(positions), dtype=RECORD_DTYPE)
+    if not len(positions):
+        return records
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    headers = _gather_rows(data, positions, vtc.HEADER_SIZE).view(
+        _header_dtype(endianess))[:, 0]
+    for name, _ in vtc.HEADER_STRUCTURE:
+        records[name] = headers[name]
+    records['offset'] = positions + vtc.HEADER_SIZE
+    return records
+
+
+def header_mask(records, header_filter):
+    """Return boolean mask of records accepted by header filter.
+
+    :param records: records found by :func:`scan_records` or a map of
+        header field names to columns, e.g. of a record index
+    :param header_filter: filter, must not be None
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    :rtype: numpy.ndarray
+    """
+    mask = np.ones(len(records['timestamp']), dtype=bool)
+    if header_filter.message_ids is not None:
+        mask &= np.isin(records['message_id'],
+                        list(header_filter.message_ids))
+    if header_filter.type_ids is not None:
+        mask &= np.isin(records['type_id'], list(header_filter.type_ids))
+    if header_filter.start is not None:
+        mask &= records['timestamp'] >= header_filter.start
+    if header_filter.end is not None:
+        mask &= records['timestamp'] < header_filter.end
+    return mask
+
+
+def filter_records(records, header_filter):
+    """Select records accepted by header filter.
+
+    :param numpy.ndarray records: records found by :func:`scan_records`
+    :param header_filter: filter, None accepts all records
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    """
+    if header_filter is None:
+        return records
+    return records[header_mask(records, header_filter)]
+
+
+def iter_batches(stream, batch_size=None, endianess=None,
+                 header_filter=None):
+    """Read stream in large chunks and yield batches of records.
+
+    Incomplete trailing record of a chunk is carried over to the next
+    one.
+
+    :param io.RawIOBase stream: binary data source
+    :param int batch_size: number of bytes read at once
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param header_filter: only accepted records are included in batches
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    :return: generator of :class:`RecordBatch`
+    """
+    batch_size = batch_size if batch_size else DEFAULT_BATCH_SIZE
+    remainder = b''
+    while True:
+        chunk = stream.read(batch_size)
+        buffer = remainder + chunk if remainder else chunk
+        if not buffer:
+            return
+        records, position = scan_records(buffer, endianess,
+                                         final=not chunk)
+        records = filter_records(records, header_filter)
+        if len(records):
+            yield RecordBatch(buffer, records)
+        remainder = buffer[position:]
+        if not chunk:
+            if remainder:
+                _logger.error('Incomplete record of {} bytes at the end of '
+                              'trace'.format(len(remainder)))
+            return
+
+
+def decode_pod_values(batch, is_little=True, type_desc_dict=None):
+    """Decode POD payloads of a batch grouped by type id and size.
+
+    Payloads of records with the same ``(type_id, size)`` are
+    gathered into a two dimensional array and reinterpreted with the
+    dtype of the type. Single element payloads are returned as one
+    dimensional array. Types described by structures are decoded into
+    structured arrays. Groups that
+    :class:`~vartools.messageutils.DecoderRegistry` would not decode
+    into values of the same dtype, e.g. sizes that are not multiples of
+    the type size, are left out.
+
+    :param batch: batch of records
+    :type batch: :class:`RecordBatch`
+    :param bool is_little: encoding of data, little or big endian.
+    :param type_desc_dict: map of type ids to type descriptions, dtypes
+        of structures are taken from it
+    :type type_desc_dict: dict
+    :return: map of ``(type_id, size)`` to ``(record_indices, values)``
+    :rtype: dict
+    """
+    type_desc_dict = type_desc_dict if type_desc_dict else dict()
+    records = batch.records
+    data = np.frombuffer(batch.buffer, dtype=np.uint8)
+    keys = (records['type_id'].astype(np.uint32) << 16) | records['size']
+    decoded = {}
+    for key in np.unique(keys):
+        type_id, size = int(key >> 16), int(key & 0xffff)
+        dtype = _value_dtype(type_id, type_desc_dict, is_little)
+        if dtype is None or size == 0 or size % dtype.itemsize != 0:
+            continue
+        indices = np.flatnonzero(keys == key)
+        values = _gather_rows(data, records['offset'][indices], size).view(
+            dtype)
+        if values.shape[1] == 1:
+            values = values[:, 0]
+        decoded[(type_id, size)] = (indices, values)
+    return decoded
+
+
+def _decode_messages(batch, mask, type_desc_dict, is_little):
+    """Return decoded messages of records selected by mask.
+
+    Data of messages are copied, so values never reference the buffer.
+    """
+    decode = vtmu.DecoderRegistry(type_desc_dict, is_little).decode
+    records = batch.records[mask]
+    with memoryview(batch.buffer) as data:
+        return [decode(vtc.TraceMessage(
+            timestamp, size, message_id, type_id,
+            data[offset:offset + size].tobytes(), None))
+                for timestamp, size, message_id, type_id, offset in zip(
+                    *(records[name].tolist() for name in RECORD_DTYPE.names))]
+
+
+def collate_records(batch, is_little=True, type_desc_dict=None):
+    """Collate values of a batch into typed columns per message id.
+
+    Result is the same as of :func:`vartools.messageutils.collate_columns`
+    applied to decoded messages of the batch. Columns of message ids
+    whose records form a single group decoded by
+    :func:`decode_pod_values` are cut out of the decoded arrays, records
+    of other message ids are decoded one by one with
+    :class:`~vartools.messageutils.DecoderRegistry`.
+
+    :param batch: batch of records
+    :type batch: :class:`RecordBatch`
+    :param bool is_little: encoding of data, little or big endian.
+    :param type_desc_dict: map of type ids to type descriptions
+    :type type_desc_dict: dict
+    :return: two maps of message ids to columns and to type id
+    :rtype: (dict, dict)
+    """
+    type_desc_dict = type_desc_dict if type_desc_dict else dict()
+    records = batch.records
+    message_ids = records['message_id']
+    ids, first = np.unique(message_ids, return_index=True)
+    order = np.argsort(first)
+    message_type_dict = dict(zip(ids[order].tolist(),
+                                 records['type_id'][first[order]].tolist()))
+    keys = ((message_ids.astype(np.uint32) << 24)
+            | (records['type_id'].astype(np.uint32) << 16) | records['size'])
+    grouped_ids, group_counts = np.unique(np.unique(keys) >> 24,
+                                          return_counts=True)
+    single_group_ids = grouped_ids[group_counts == 1]
+    timestamps = records['timestamp'].astype(np.uint64)
+    id_columns_dict = dict()
+    for indices, values in decode_pod_values(
+            batch, is_little, type_desc_dict).values():
+        if values.dtype.names is None:
+            values = values.astype(values.dtype.newbyteorder('='),
+                                   copy=False)
+        group_ids = message_ids[indices].astype(np.int16)
+        group_ids[~np.isin(group_ids, single_group_ids)] = -1
+        for message_id, rows in vtmu.split_by_id(
+                np.arange(len(indices)), group_ids).items():
+            id_columns_dict[message_id] = vtc.ValueColumns(
+                timestamps[indices[rows]], values[rows])
+    mask = ~np.isin(message_ids, list(id_columns_dict))
+    if mask.any():
+        id_columns_dict.update(vtmu.collate_columns(
+            _decode_messages(batch, mask, type_desc_dict, is_little),
+            type_desc_dict)[0])
+    return {message_id: id_columns_dict[message_id]
+            for message_id in message_type_dict
+            if message_id in id_columns_dict}, message_type_dict
@@ -33,17 +33,79 @@ EnumList = namedtuple('EnumList', 'name comment members category')
 #: Named tuple to store name and comment together.
 Description = namedtuple('Description', 'name comment')
 
-#: Named tuple with type descriptions
-TypeDescription = namedtuple('TypeDescription',
-                             Description._fields + ('codes', 'struct_object'))
+#: Named tuple with type descriptions, ``dtype`` is the NumPy dtype of
+#: types described by a structure, None for other types.
+TypeDescription = namedtuple(
+    'TypeDescription',
+    Description._fields + ('codes', 'struct_object', 'dtype'),
+    defaults=(None,))
+
+#: Plain-old-data structure declared in a header.
+#: Fields: ``name`` - name of the structure, ``comment`` - last one line
+#: comment before the structure, ``fields`` - list of
+#: :class:`FieldDescription` in declaration order.
+StructList = namedtuple('StructList', 'name comment fields')
+
+#: Member of a structure, ``type_name`` is a fixed width type or a name
+#: of another structure, ``shape`` - dimensions of a fixed array, empty
+#: for scalars.
+FieldDescription = namedtuple('FieldDescription',
+                              Description._fields + ('type_name', 'shape'))
 
 #: Set little endian as default.
 DEFAULT_ENDIANESS = '<'
 HEADER_STRUCTURE = [('timestamp', 'I'), ('size', 'H'),
                     ('message_id', 'B'), ('type_id', 'B')]
+#: ``struct`` format of the whole header without endianess prefix.
+HEADER_FORMAT = ''.join(f for _, f in HEADER_STRUCTURE)
+#: Size of serialized header in bytes.
+HEADER_SIZE = struct.calcsize('<' + HEADER_FORMAT)
 ALIGNMENT_SIZE = 4
 
 #: Namedtuple to store header information, raw data and value
 TraceMessage = namedtuple(
     'TraceMessage', ' '.join([n for n, f in HEADER_STRUCTURE]
                              + ['data', 'value']))
+
+#: Collated values of one message id stored in two arrays of equal length.
+ValueColumns = namedtuple('ValueColumns', 'times values')
+
+#: Header level filter, fields set to None accept everything.
+#: Fields: ``message_ids`` and ``type_ids`` - sets of accepted ids,
+#: ``start`` and ``end`` - accepted timestamp range ``[start, end)``.
+HeaderFilter = namedtuple('HeaderFilter', 'message_ids type_ids start end')
+
+
+def create_header_filter(message_ids=None, type_ids=None,
+                         start=None, end=None):
+    """Create :class:`HeaderFilter` or None if nothing is filtered."""
+    if message_ids is None and type_ids is None \
+       and start is None and end is None:
+        return None
+    return HeaderFilter(
+        message_ids=None if message_ids is None else frozenset(message_ids),
+        type_ids=None if type_ids is None else frozenset(type_ids),
+        start=start, end=end)
+
+
+def is_header_accepted(header_filter, timestamp, message_id, type_id):
+    """Check header fields against filter, None filter accepts all."""
+    if header_filter is None:
+        return True
+    if header_filter.message_ids is not None \
+       and message_id not in header_filter.message_ids:
+        return False
+    if header_filter.type_ids is not None \
+       and type_id not in header_filter.type_ids:
+        return False
+    if header_filter.start is not None and timestamp < header_filter.start:
+        return False
+    if header_filter.end is not None and timestamp >= header_filter.end:
+        return False
+    return True
+
+
+def padding_size(size):
+    """Return number of padding bytes that follow data of given size."""
+    remainder = size % ALIGNMENT_SIZE
+    return ALIGNMENT_SIZE - remainder if remainder else 0
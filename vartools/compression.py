@@ -0,0 +1,160 @@
+"""Transparent reading of compressed traces.
+
+Codec is detected from magic bytes at the beginning of the stream.
+Decompression runs in a background thread that fills a bounded queue
+of blocks, so it overlaps with decoding of records.
+"""
+
+import bz2
+import gzip
+import lzma
+import logging
+import threading
+from queue import Queue
+
+#: Number of decompressed bytes passed between threads at once.
+DEFAULT_BLOCK_SIZE = 1 << 20
+#: Maximal number of decompressed blocks waiting to be read.
+DEFAULT_QUEUE_SIZE = 8
+
+#: Map codec names to magic bytes and file object constructors.
+CODEC_DICT = {'gzip': (b'\x1f\x8b', gzip.GzipFile),
+              'xz': (b'\xfd7zXZ\x00', lzma.LZMAFile),
+              'bz2': (b'BZh', bz2.BZ2File)}
+
+_MAGIC_SIZE = max(len(m) for m, _ in CODEC_DICT.values())
+
+_logger = logging.getLogger(__name__)
+
+
+def _peek(stream, size):
+    """Return first bytes of stream without consuming them."""
+    if hasattr(stream, 'peek'):
+        return stream.peek(size)[:size]
+    if hasattr(stream, 'seekable') and stream.seekable():
+        position = stream.tell()
+        data = stream.read(size)
+        stream.seek(position)
+        return data
+    return b''
+
+
+def detect_codec(stream):
+    """Return name of compression codec or None for raw traces.
+
+    :param stream: binary stream that supports ``peek`` or ``seek``
+    """
+    magic = _peek(stream, _MAGIC_SIZE)
+    for codec, (codec_magic, _) in CODEC_DICT.items():
+        if magic.startswith(codec_magic):
+            return codec
+    return None
+
+
+class ReadAheadStream:
+    """Binary stream that decompresses data in a background thread."""
+
+    def __init__(self, stream, codec, block_size=None, queue_size=None):
+        """Start decompression thread.
+
+        :param stream: compressed binary stream
+        :param str codec: one of :const:`CODEC_DICT` keys
+        :param int block_size: number of bytes decompressed at once
+        :param int queue_size: number of blocks decompressed in advance
+        """
+        self._decompressed = CODEC_DICT[codec][1](fileobj=stream) \
+            if codec == 'gzip' else CODEC_DICT[codec][1](stream)
+        self._block_size = block_size if block_size else DEFAULT_BLOCK_SIZE
+        self._queue = Queue(queue_size if queue_size else DEFAULT_QUEUE_SIZE)
+        self._block = b''
+        self._position = 0
+        self._is_exhausted = False
+        self._is_closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decompress(self):
+        """Put decompressed blocks into queue, None marks the end.
+
+        An error of decompression is kept and raised by :meth:`read`.
+        """
+        try:
+            while not self._is_closed:
+                block = self._decompressed.read(self._block_size)
+                if not block:
+                    break
+                self._queue.put(block)
+        except Exception as error:  # pylint: disable=W0703
+            _logger.error('Decompression failed: {}'.format(error))
+            self._error = error
+        finally:
+            self._queue.put(None)
+
+    def _next_block(self):
+        """Wait for the next decompressed block."""
+        block = self._queue.get()
+        if block is None:
+            self._is_exhausted = True
+            return b''
+        return block
+
+    def read(self, size=-1):
+        """Read up to size bytes, less only at the end of data.
+
+        :raises Exception: error of decompression, once all data
+            decompressed before it are read
+        """
+        parts = []
+        remaining = size
+        while remaining != 0:
+            if self._position == len(self._block):
+                if self._is_exhausted:
+                    if self._error is not None:
+                        error, self._error = self._error, None
+                        raise error
+                    break
+                self._block = self._next_block()
+                self._position = 0
+                continue
+            end = (len(self._block) if remaining < 0
+                   else min(len(self._block), self._position + remaining))
+            parts.append(self._block[self._position:end])
+            if remaining > 0:
+                remaining -= end - self._position
+            self._position = end
+        return b''.join(parts)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        """Stop decompression thread."""
+        self._is_closed = True
+        while not self._is_exhausted:
+            self._next_block()
+        self._thread.join()
+        self._decompressed.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def open_decompressed(stream, **kwargs):
+    """Wrap compressed stream into :class:`ReadAheadStream`.
+
+    Raw streams are returned unchanged, keyword arguments are passed
+    to :class:`ReadAheadStream` constructor.
+    """
+    codec = detect_codec(stream)
+    if not codec:
+        return stream
+    _logger.debug('Reading {} compressed trace'.format(codec))
+    return ReadAheadStream(stream, codec, **kwargs)
@@ -2,37 +2,270 @@
 
 # pylint: disable=W0212
 
+import os
+import logging
+import functools
 from datetime import datetime
 
+import numpy as np
+
 import vartools.parser.utils as vtpu
 import vartools.tracereader as vttr
 import vartools.messageutils as vtmu
 import vartools.hdf5 as vthdf5
+import vartools.parallel as vtpl
+import vartools.traceindex as vtti
+import vartools.timeutils as vttu
 
 _DEFAULT_EVENT_FORMAT = '<i'
 
+_logger = logging.getLogger(__name__)
+
+
+def _stream_values(exporter, reader, type_desc_dict, timestamp_to_time,
+                   store_offset):
+    """Decode messages and pass them to streaming exporter.
+
+    Exporter is closed and offset after the last exported record is
+    stored even if reading is interrupted, e.g. when following of a
+    live trace is stopped by a signal.
+
+    :param store_offset: function called with offset after the last
+        exported record, None if reader does not track offsets
+    """
+    decode = vtmu.DecoderRegistry(type_desc_dict).decode
+    offset = getattr(reader, 'offset', None)
+    try:
+        for message in reader:
+            exporter.add(decode(message),
+                         timestamp_to_time(message.timestamp)
+                         if timestamp_to_time else None)
+            if offset is not None:
+                offset = reader.offset
+    finally:
+        exporter.close()
+        store_offset(offset)
+
+
+def _time_converter(unwrapper, calibration, timestamp_to_time):
+    """Return function that converts raw timestamps of all records.
+
+    :return: function or None if timestamps are not unwrapped or
+        calibrated
+    """
+    if not unwrapper and not calibration:
+        return None
+
+    def convert(timestamps):
+        times = vttu.convert_times(timestamps, unwrapper, calibration)
+        if timestamp_to_time:
+            times = np.array([timestamp_to_time(t) for t in times.tolist()])
+        return times
+
+    return convert
+
+
+def _open_group(h5file, group, comment, append, message_desc_dict,
+                type_desc_dict):
+    """Create trace group or open existing one in append mode.
+
+    :return: group or None if existing tables do not match descriptions
+    """
+    path = '/' + '/'.join(group)
+    if append and path in h5file:
+        trace_group = h5file.get_node(path)
+        if not vthdf5.check_schema(h5file, trace_group, message_desc_dict,
+                                   type_desc_dict):
+            _logger.error('Can not append to {}'.format(path))
+            return None
+        return trace_group
+    trace_group = h5file.create_group('/' + '/'.join(group[:-1]), group[-1],
+                                      title=comment, createparents=True)
+    trace_group._v_attrs.date = datetime.now().strftime('%H:%M %d/%m/%Y')
+    return trace_group
+
+
+def _resume_offset(trace_group, trace_file):
+    """Return offset of the first record not stored in the group yet.
+
+    Reading is resumed only if the group was filled from the same
+    uncompressed trace file.
+    """
+    attrs = trace_group._v_attrs
+    if 'trace_offset' not in attrs or not vttr.is_regular_file(trace_file) \
+       or vttr.is_compressed(trace_file) \
+       or attrs.trace_path != os.path.abspath(trace_file.name):
+        return 0
+    if attrs.trace_offset > os.fstat(trace_file.fileno()).st_size:
+        _logger.warning('Trace {} is shorter than stored part, reading it '
+                        'from the beginning'.format(trace_file.name))
+        return 0
+    return int(attrs.trace_offset)
+
+
+def _store_offset(trace_group, trace_file, offset, unwrapper=None):
+    """Record how much of a regular trace file was stored in the group.
+
+    State of timestamp unwrapper is stored too, so unwrapping of
+    resumed trace continues after the last wraparound.
+    """
+    if offset is None or not vttr.is_regular_file(trace_file):
+        return
+    attrs = trace_group._v_attrs
+    attrs.trace_path = os.path.abspath(trace_file.name)
+    attrs.trace_offset = offset
+    if unwrapper is not None and unwrapper.last is not None:
+        attrs.timestamp_offset = unwrapper.offset
+        attrs.last_timestamp = unwrapper.last
+
+
+def _resume_unwrapper(trace_group, offset):
+    """Create timestamp unwrapper, restore its state if trace is resumed."""
+    attrs = trace_group._v_attrs
+    if offset and 'last_timestamp' in attrs:
+        return vttu.TimestampUnwrapper(offset=int(attrs.timestamp_offset),
+                                       last=int(attrs.last_timestamp))
+    return vttu.TimestampUnwrapper()
+
+
+def _open_resumed(trace_file, offset, follow, header_filter, **kwargs):
+    """Open trace reader that starts from offset of a regular file."""
+    if not offset:
+        return vttr.open_trace(trace_file, follow=follow,
+                               header_filter=header_filter, **kwargs)
+    _logger.info('Resuming {0} from offset {1}'.format(trace_file.name,
+                                                       offset))
+    trace_file.seek(offset)
+    if follow:
+        return vttr.TraceReader(trace_file, follow=True,
+                                header_filter=header_filter, **kwargs)
+    return vttr.MappedTraceReader(trace_file, header_filter=header_filter)
+
 
 def to_hdf5(h5file, group, trace_file, comment=None, headers=None,
-            event_format=None, timestamp_to_time=None):
+            event_format=None, timestamp_to_time=None, workers=None,
+            header_filter=None, unwrap_timestamps=False, tick_period=None,
+            epoch=None, streaming=False, buffer_size=None, follow=False,
+            batch_size=None, complib=None, complevel=None, shuffle=True,
+            chunk_size=None, index=False, append=False, all_messages=False,
+            header_workers=None):
     """Read trace file and store data into hdf5 format.
 
     :param group: list of strings with path to the trace group
     :param str comment: comment to the group
     :param list headers: paths to headers with trace description
     :param str event_format: valid ``struct`` format specifier
+    :param int workers: decode trace in that many processes while
+        this process writes tables, see
+        :func:`vartools.parallel.decode_pipeline`; only uncompressed
+        regular files can be decoded in parallel
+    :param header_filter: only records accepted by the filter are
+        exported, payloads of other records are not read
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    :param bool unwrap_timestamps: unwrap 32 bit timestamps into
+        monotonically increasing tick counts
+    :param float tick_period: duration of a timestamp tick in seconds,
+        if set timestamps are converted into absolute time
+    :param float epoch: time of the zero tick in seconds
+    :param bool streaming: write values into tables while trace is
+        read instead of collating the whole trace in memory
+    :param int buffer_size: byte budget of buffered rows in streaming
+        mode
+    :param bool follow: wait for new records at the end of trace,
+        implies streaming, buffered rows are written while waiting
+    :param int batch_size: number of rows appended to a table at once
+    :param str complib: compression library of tables, see
+        :func:`vartools.hdf5.create_filters`
+    :param int complevel: compression level from 0 to 9
+    :param bool shuffle: enable byte shuffle filter for compression
+    :param int chunk_size: number of rows in a table chunk
+    :param bool index: index time columns and values of event tables
+        for fast time range queries, see :mod:`vartools.query`
+    :param bool append: append values to tables of existing group,
+        descriptions of stored messages must not change; if the group
+        was filled from the same trace file only new records are read
+    :param bool all_messages: create time indexed table that references
+        values of all messages, see :func:`vartools.hdf5.export`
+    :param int header_workers: parse headers in that many processes
     """
     comment = comment if comment else ''
     headers = headers if headers else []
     event_format = event_format if event_format else _DEFAULT_EVENT_FORMAT
     message_desc_dict, type_desc_dict = vtpu.parse_headers(
-        headers, event_format=event_format)
-    trace = vttr.TraceReader(trace_file)
-    id_values_dict, message_type_dict = vtmu.collate_values(
-        (vtmu.fill_custom_value(vtmu.fill_pod_value(m), type_desc_dict)
-         for m in trace), timestamp_to_time)
-    parent_group = '/' + '/'.join(group[:-1])
-    trace_group = h5file.create_group(parent_group, group[-1], title=comment,
-                                      createparents=True)
-    trace_group._v_attrs.date = datetime.now().strftime('%H:%M %d/%m/%Y')
+        headers, workers=header_workers, event_format=event_format)
+    calibration = (vttu.Calibration(tick_period if tick_period else 1.0,
+                                    epoch if epoch else 0.0)
+                   if tick_period or epoch else None)
+    filters = vthdf5.create_filters(complib, complevel, shuffle)
+    trace_group = _open_group(h5file, group, comment, append,
+                              message_desc_dict, type_desc_dict)
+    if trace_group is None:
+        return
+    offset = _resume_offset(trace_group, trace_file) if append else 0
+    unwrapper = (_resume_unwrapper(trace_group, offset) if unwrap_timestamps
+                 else None)
+    if workers and workers > 1 and (unwrapper or calibration):
+        _logger.warning('Timestamp conversion needs whole trace in order, '
+                        'decoding in a single process')
+        workers = None
+    if workers and workers > 1 and not follow and not offset \
+            and vttr.is_regular_file(trace_file) \
+            and not vttr.is_compressed(trace_file):
+        trace_index = vtti.load_or_build(trace_file.name, save=False)
+        layouts, row_counts = vtpl.trace_layouts(
+            trace_index, type_desc_dict, header_filter)
+        if append and not vthdf5.check_schema(
+                h5file, trace_group, message_desc_dict, type_desc_dict,
+                layouts):
+            _logger.error('Can not append to {}'.format(
+                trace_group._v_pathname))
+            return
+        name_table_dict = dict()
+
+        def write(id_values_dict, message_type_dict):
+            for data_table in vthdf5.append_collated(
+                    h5file, trace_group, id_values_dict, message_type_dict,
+                    message_desc_dict, type_desc_dict, batch_size, filters,
+                    chunk_size, all_messages, layouts, row_counts):
+                name_table_dict[data_table.name] = data_table
+
+        vtpl.decode_pipeline(trace_file.name, headers, event_format, workers,
+                             write, timestamp_to_time,
+                             header_filter=header_filter, index=trace_index)
+        vthdf5.index_group(h5file, trace_group,
+                           list(name_table_dict.values()) if index else [],
+                           all_messages)
+        _store_offset(trace_group, trace_file,
+                      trace_index.offset(len(trace_index)))
+        return
+    convert_times = _time_converter(unwrapper, calibration,
+                                    timestamp_to_time)
+    if convert_times:
+        timestamp_to_time = None
+    if streaming or follow:
+        exporter = vthdf5.StreamingExporter(
+            h5file, trace_group, message_desc_dict, type_desc_dict,
+            buffer_size, batch_size, filters, chunk_size, index,
+            all_messages, convert_times)
+        reader = _open_resumed(trace_file, offset, follow, header_filter,
+                               idle_callback=exporter.flush)
+        _stream_values(exporter, reader, type_desc_dict, timestamp_to_time,
+                       functools.partial(_store_offset, trace_group,
+                                         trace_file, unwrapper=unwrapper))
+        return
+    reader = _open_resumed(trace_file, offset, False, header_filter)
+    decode = vtmu.DecoderRegistry(type_desc_dict).decode
+    id_values_dict, message_type_dict = vtmu.collate_columns(
+        (decode(m) for m in reader), type_desc_dict, timestamp_to_time,
+        convert_times)
+    if append and not vthdf5.check_schema(
+            h5file, trace_group, message_desc_dict, type_desc_dict,
+            {message_id: vthdf5.value_layout(columns.values)
+             for message_id, columns in id_values_dict.items()}):
+        _logger.error('Can not append to {}'.format(trace_group._v_pathname))
+        return
     vthdf5.export(h5file, trace_group, id_values_dict, message_type_dict,
-                  message_desc_dict, type_desc_dict)
+                  message_desc_dict, type_desc_dict, batch_size, filters,
+                  chunk_size, index, all_messages)
+    _store_offset(trace_group, trace_file, getattr(reader, 'offset', None),
+                  unwrapper)
@@ -1,13 +1,44 @@
 """Utilities for exporting into hdf5."""
 
+# pylint: disable=W0212
+
+import sys
 import logging
 import functools
+from array import array
+
+import numpy as np
 import tables
 
 import vartools.common as vtc
+import vartools.messageutils as vtmu
 
 _logger = logging.getLogger(__name__)
 
+#: Byte budget of rows buffered by :class:`StreamingExporter`.
+DEFAULT_STREAMING_BUFFER_SIZE = 1 << 26
+#: Number of rows appended to a table at once.
+DEFAULT_BATCH_SIZE = 1 << 16
+#: Suffix of variable length array that stores values of a table.
+VALUE_ARRAY_SUFFIX = '_values'
+#: Compression level used if only compression library is specified.
+DEFAULT_COMPLEVEL = 5
+#: Name of the table that references values of all messages in order.
+ALL_MESSAGES_TABLE = 'all_messages'
+
+#: Column of times, ``Time64Col`` stores whole seconds in 32 bits, so
+#: tick counts and unwrapped timestamps are stored as doubles. Tables
+#: written by older versions have ``Time64Col`` columns, see
+#: :func:`check_schema`.
+_TIME_COL = tables.Float64Col
+#: Range of times that fit ``Time64Col`` of older tables.
+_TIME64_RANGE = (-2.0 ** 31, 2.0 ** 31)
+
+_ALL_MESSAGES_FORMAT = {'time': _TIME_COL(pos=0),
+                        'message_id': tables.UInt8Col(pos=1),
+                        'type_id': tables.UInt8Col(pos=2),
+                        'row': tables.Int64Col(pos=3)}
+
 _FORMAT_COL_DICT = {'b': tables.Int8Col, 'B': tables.UInt8Col,
                     'h': tables.Int16Col, 'H': tables.UInt16Col,
                     'i': tables.Int32Col, 'I': tables.UInt32Col,
@@ -16,9 +47,53 @@ _FORMAT_COL_DICT = {'b': tables.Int8Col, 'B': tables.UInt8Col,
                     'f': tables.Float32Col, 'd': tables.Float64Col}
 
 
+def _compound_columns(dtype, shape=(), pos=None):
+    """Describe nested columns of a structured dtype.
+
+    PyTables does not support arrays of nested columns, so arrays of
+    structures are stored as structures of arrays: ``shape`` is
+    prepended to shapes of all nested columns.
+
+    :return: nested description dictionary
+    """
+    columns = {} if pos is None else {'_v_pos': pos}
+    for field_pos, name in enumerate(dtype.names):
+        field_dtype = dtype.fields[name][0]
+        field_shape = tuple(shape) + field_dtype.shape
+        if field_dtype.base.names:
+            columns[name] = _compound_columns(field_dtype.base, field_shape,
+                                              field_pos)
+        else:
+            columns[name] = tables.Col.from_dtype(
+                np.dtype((field_dtype.base, field_shape)), pos=field_pos)
+    return columns
+
+
+def _leaf_fields(dtype, path=()):
+    """Return paths, base dtypes and shapes of not nested fields."""
+    if not dtype.base.names:
+        return [(path, dtype.base.newbyteorder('='), dtype.shape)]
+    return [leaf for name in dtype.base.names
+            for leaf in _leaf_fields(dtype.base.fields[name][0],
+                                     path + (name,))]
+
+
+def _copy_fields(records, values):
+    """Copy structured values into nested columns field by field."""
+    for name in records.dtype.names:
+        if records.dtype.fields[name][0].base.names:
+            _copy_fields(records[name], values[name])
+        else:
+            records[name] = values[name]
+
+
 def _get_col_type(type_id, type_desc_dict):
     """Try to figure out hdf5 type from type description.
 
+    Types described by structures are stored in nested columns, for
+    them a function that creates the nested description is returned,
+    see :func:`_compound_columns`.
+
     :param int type_id: trace type id
     :param type_desc_dict: map of type ids to type descriptions
     :type type_desc_dict: dict
@@ -33,6 +108,9 @@ def _get_col_type(type_id, type_desc_dict):
     if not type_desc_dict[type_id]:
         _logger.error('No format for type id {}'.format(type_id))
         return None
+    if type_desc_dict[type_id].dtype is not None:
+        return functools.partial(_compound_columns,
+                                 type_desc_dict[type_id].dtype)
     if not type_desc_dict[type_id].codes:
         type_format = type_desc_dict[type_id].struct_object.format[1]
         return _FORMAT_COL_DICT[type_format]
@@ -42,14 +120,442 @@ def _get_col_type(type_id, type_desc_dict):
                              vtc.DEFAULT_ENUM_BASE)
 
 
+def create_filters(complib=None, complevel=None, shuffle=True):
+    """Create compression filters for exported tables.
+
+    Unavailable compression libraries are replaced with zlib.
+
+    :param str complib: compression library, e.g. ``zlib``, ``blosc``,
+        ``lzo`` or ``bzip2``
+    :param int complevel: compression level from 0 to 9
+    :param bool shuffle: enable byte shuffle filter
+    :return: filters or None if data should not be compressed
+    :rtype: :class:`tables.Filters`
+    """
+    if not complib and not complevel:
+        return None
+    complib = complib if complib else 'zlib'
+    if complib not in tables.filters.all_complibs \
+       or tables.which_lib_version(complib) is None:
+        _logger.error('Compression library {} is not available, using '
+                      'zlib'.format(complib))
+        complib = 'zlib'
+    complevel = complevel if complevel is not None else DEFAULT_COMPLEVEL
+    return tables.Filters(complevel=complevel, complib=complib,
+                          shuffle=shuffle)
+
+
+def value_layout(values):
+    """Return shape of value rows and flag of variable row length.
+
+    :param values: sequence of values of one message id
+    :rtype: (tuple, bool)
+    """
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values.shape[1:], False
+    shapes = set(np.shape(v) for v in values)
+    if len(shapes) > 1:
+        return (), True
+    return (shapes.pop() if shapes else ()), False
+
+
+def _create_table(hdf5file, group, message_id, type_id,
+                  message_desc_dict, type_desc_dict, filters=None,
+                  chunk_size=None, expected_rows=None, value_shape=(),
+                  is_variable=False):
+    """Create table for values of a message id or open existing one.
+
+    Fixed length arrays are stored in a multidimensional ``value``
+    column. Variable length arrays are stored in a
+    :class:`tables.VLArray` with :const:`VALUE_ARRAY_SUFFIX` appended
+    to the table name, row ``i`` of the array corresponds to row ``i``
+    of the table which contains only ``time`` column. Structures are
+    stored in a nested ``value`` column with a column per field,
+    variable length arrays of structures are not supported.
+
+    :param filters: compression filters
+    :type filters: :class:`tables.Filters`
+    :param int chunk_size: number of rows in a chunk
+    :param int expected_rows: number of rows the table will contain
+    :param tuple value_shape: shape of fixed length array values
+    :param bool is_variable: values are arrays of different lengths
+    :return: table or None if message or its type is not described
+    """
+    if message_id not in message_desc_dict:
+        _logger.error(
+            'No description for message id {}'.format(message_id))
+        return None
+    col_type = _get_col_type(type_id, type_desc_dict)
+    if not col_type:
+        return None
+    name = message_desc_dict[message_id].name
+    if is_variable and type_id in type_desc_dict \
+       and type_desc_dict[type_id].dtype is not None:
+        _logger.error('Variable length arrays of structures can not be '
+                      'stored in {}'.format(name))
+        return None
+    comment = message_desc_dict[message_id].comment
+    group_node = hdf5file.get_node(group)
+    if name in group_node:
+        return group_node._f_get_child(name)
+    table_format = {'time': _TIME_COL(pos=0)}
+    if not is_variable:
+        table_format['value'] = col_type(shape=value_shape, pos=1)
+    kwargs = {}
+    if expected_rows:
+        kwargs['expectedrows'] = expected_rows
+    data_table = hdf5file.create_table(
+        group, name, table_format, comment, filters=filters,
+        chunkshape=(chunk_size,) if chunk_size else None, **kwargs)
+    if is_variable:
+        atom = tables.Atom.from_dtype(np.dtype(col_type(pos=1).dtype))
+        hdf5file.create_vlarray(group, name + VALUE_ARRAY_SUFFIX, atom,
+                                comment, filters=filters, **kwargs)
+        data_table.attrs.value_array = name + VALUE_ARRAY_SUFFIX
+    data_table.attrs.message_id = message_id
+    data_table.attrs.type_id = type_id
+    return data_table
+
+
+def _fits_layout(data_table, col_type, value_shape, is_variable):
+    """Check that values with given layout can be appended to a table."""
+    if 'value' not in data_table.colnames:
+        return True
+    if is_variable:
+        return False
+    column = col_type(shape=value_shape, pos=1)
+    expected = (tables.Description(column)._v_dtype
+                if isinstance(column, dict) else column.dtype)
+    return [s for _, _, s in _leaf_fields(expected)] \
+        == [s for _, _, s in _leaf_fields(data_table.dtype['value'])]
+
+
+def check_schema(hdf5file, group, message_desc_dict, type_desc_dict,
+                 layouts=None):
+    """Check that existing tables can be extended with new values.
+
+    Message ids and type ids are taken from table attributes, tables
+    without them are not checked. If layouts of new values are known,
+    tables with fixed length array columns must have the same shape,
+    variable length arrays fit only tables with value arrays. Times of
+    tables written by older versions are stored in ``Time64Col`` with
+    32 bit seconds and microsecond resolution, such tables are extended
+    but times out of range of the column are rejected by
+    :func:`append_columns`.
+
+    :param hdf5file: hdf5 file object
+    :param group: group with trace tables
+    :type group: str or hdf5 group
+    :param message_desc_dict: map of message ids to descriptions
+    :type message_desc_dict: dict
+    :param type_desc_dict: map of type ids to type descriptions
+    :type type_desc_dict: dict
+    :param layouts: map of message ids to value layouts, see
+        :func:`value_layout`
+    :type layouts: dict
+    :return: True if all tables match descriptions
+    """
+    layouts = layouts if layouts else dict()
+    is_compatible = True
+    for data_table in hdf5file.get_node(group)._f_iter_nodes('Table'):
+        if 'message_id' not in data_table.attrs:
+            continue
+        message_id = int(data_table.attrs.message_id)
+        description = message_desc_dict.get(message_id)
+        if description is None or description.name != data_table.name:
+            _logger.error('Table {0} does not match message id {1}'.format(
+                data_table.name, message_id))
+            is_compatible = False
+            continue
+        if _is_time64(data_table):
+            _logger.warning(
+                'Table {} stores times in Time64 column of an older version, '
+                'times of at least 2**31 can not be appended'.format(
+                    data_table.name))
+        if 'value' not in data_table.colnames:
+            continue
+        col_type = _get_col_type(int(data_table.attrs.type_id),
+                                 type_desc_dict)
+        if not col_type:
+            is_compatible = False
+            continue
+        column = col_type(pos=1)
+        if isinstance(column, dict):
+            is_changed = [f[:2] for f in _leaf_fields(
+                tables.Description(column)._v_dtype)] \
+                != [f[:2] for f in _leaf_fields(data_table.dtype['value'])]
+        else:
+            is_changed = column.dtype.base \
+                != data_table.coldescrs['value'].dtype.base \
+                or isinstance(column, tables.EnumCol) \
+                and column.enum != data_table.get_enum('value')
+        if is_changed:
+            _logger.error('Type of table {} has changed'.format(
+                data_table.name))
+            is_compatible = False
+        elif message_id in layouts and not _fits_layout(
+                data_table, col_type, *layouts[message_id]):
+            _logger.error('Shape of values of table {} has changed'.format(
+                data_table.name))
+            is_compatible = False
+    return is_compatible
+
+
+def _is_time64(data_table):
+    """Check if times of table are stored in ``Time64Col``."""
+    return data_table.coldescrs['time'].type == 'time64'
+
+
+def _fits_time_column(data_table, times):
+    """Check that times can be stored in time column of a table."""
+    if not len(times) or not _is_time64(data_table):
+        return True
+    if times.min() >= _TIME64_RANGE[0] and times.max() < _TIME64_RANGE[1]:
+        return True
+    _logger.error('Times do not fit Time64 column of {}, skipped'.format(
+        data_table.name))
+    return False
+
+
+def _check_enum_values(data_table, values):
+    """Log codes that are not members of event enum column."""
+    enum = data_table.get_enum('value')
+    unknown = np.setdiff1d(values, [code for _, code in enum])
+    if len(unknown):
+        _logger.error('Unknown event codes in {0}: {1}'.format(
+            data_table.name, ', '.join(str(c) for c in unknown)))
+
+
+def _append_variable_rows(data_table, times, values, batch_size):
+    """Append times to a table and variable length values to its array."""
+    value_array = data_table._v_parent._f_get_child(
+        data_table.attrs.value_array)
+    for start in range(0, len(times), batch_size):
+        end = min(start + batch_size, len(times))
+        records = np.empty(end - start, dtype=data_table.dtype)
+        records['time'] = times[start:end]
+        data_table.append(records)
+    value_dtype = value_array.atom.dtype
+    for value in values:
+        value_array.append(np.asarray(value, dtype=value_dtype).ravel())
+    data_table.flush()
+    value_array.flush()
+
+
+def append_columns(data_table, times, values, batch_size=None):
+    """Append time and value columns to a table in large batches.
+
+    Every batch is converted into a structured array with the table
+    description and written with a single :meth:`tables.Table.append`.
+    Event columns are filled with raw codes in the enum base type, the
+    codes are validated once for the whole column. Structured values
+    are copied into nested columns field by field. Times that do not
+    fit ``Time64Col`` of a table written by an older version are
+    rejected.
+
+    :param data_table: table created by :func:`export` or
+        :class:`StreamingExporter`
+    :param times: sequence of times
+    :param values: sequence of values of the same length
+    :param int batch_size: number of rows appended at once
+    """
+    batch_size = batch_size if batch_size else DEFAULT_BATCH_SIZE
+    times = np.asarray(times, dtype=np.float64)
+    if not _fits_time_column(data_table, times):
+        return
+    if 'value' not in data_table.colnames:
+        _append_variable_rows(data_table, times, values, batch_size)
+        return
+    value_dtype = data_table.dtype['value']
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        values = list(values)
+    try:
+        if value_dtype.names:
+            values = np.asarray(values)
+        else:
+            values = np.asarray(values, dtype=value_dtype.base).reshape(
+                (len(times),) + value_dtype.shape)
+    except ValueError:
+        _logger.error('Values do not fit value column of {}, skipped'.format(
+            data_table.name))
+        return
+    if isinstance(data_table.coldescrs.get('value'), tables.EnumCol):
+        _check_enum_values(data_table, values)
+    for start in range(0, len(times), batch_size):
+        end = min(start + batch_size, len(times))
+        records = np.empty(end - start, dtype=data_table.dtype)
+        records['time'] = times[start:end]
+        if value_dtype.names:
+            _copy_fields(records['value'], values[start:end])
+        else:
+            records['value'] = values[start:end]
+        data_table.append(records)
+    data_table.flush()
+
+
+def create_indexes(data_table):
+    """Create completely sorted indexes used by time range queries.
+
+    The ``time`` column is always indexed, ``value`` column is indexed
+    only for event tables. Already existing indexes are updated.
+
+    :param data_table: table created by :func:`export` or
+        :class:`StreamingExporter`
+    """
+    columns = [data_table.cols.time]
+    if 'value' in data_table.colnames \
+       and isinstance(data_table.coldescrs.get('value'), tables.EnumCol):
+        columns.append(data_table.cols.value)
+    for column in columns:
+        if column.is_indexed:
+            column.reindex_dirty()
+        else:
+            column.create_csindex()
+
+
+def _open_all_messages_table(hdf5file, group, filters=None,
+                             expected_rows=None):
+    """Return table of all messages, create it if it does not exist."""
+    group_node = hdf5file.get_node(group)
+    if ALL_MESSAGES_TABLE in group_node:
+        return group_node._f_get_child(ALL_MESSAGES_TABLE)
+    kwargs = {}
+    if expected_rows:
+        kwargs['expectedrows'] = expected_rows
+    return hdf5file.create_table(group, ALL_MESSAGES_TABLE,
+                                 _ALL_MESSAGES_FORMAT, 'All messages',
+                                 filters=filters, **kwargs)
+
+
+def append_messages(all_table, times, message_ids, type_ids, rows,
+                    batch_size=None):
+    """Append references to message values in large batches.
+
+    :param all_table: table of all messages
+    :param times: sequence of times
+    :param message_ids: sequence of message ids
+    :param type_ids: sequence of type ids
+    :param rows: sequence of row numbers in tables of message ids
+    :param int batch_size: number of rows appended at once
+    """
+    batch_size = batch_size if batch_size else DEFAULT_BATCH_SIZE
+    columns = {'time': times, 'message_id': message_ids,
+               'type_id': type_ids, 'row': rows}
+    for start in range(0, len(times), batch_size):
+        end = min(start + batch_size, len(times))
+        records = np.empty(end - start, dtype=all_table.dtype)
+        for name, column in columns.items():
+            records[name] = column[start:end]
+        all_table.append(records)
+    all_table.flush()
+
+
+def _is_time_ordered(data_table):
+    """Check that times of a table never decrease."""
+    last = -np.inf
+    for start in range(0, data_table.nrows, DEFAULT_BATCH_SIZE):
+        times = data_table.read(start, start + DEFAULT_BATCH_SIZE,
+                                field='time')
+        if times[0] < last or np.any(times[1:] < times[:-1]):
+            return False
+        last = times[-1]
+    return True
+
+
+def _sort_by_time(hdf5file, data_table):
+    """Replace table with its copy sorted by the indexed time column."""
+    name = data_table.name
+    sorted_table = data_table.copy(newname=name + '_sorted', sortby='time',
+                                   propindexes=True)
+    data_table.remove()
+    sorted_table.move(newname=name)
+    hdf5file.flush()
+
+
+def index_group(hdf5file, group, data_tables, all_messages=False):
+    """Create indexes of message tables and of table of all messages.
+
+    Rows of table of all messages are ordered only within every
+    appended piece or flush, a late record may be older than rows of
+    earlier pieces, so the table is sorted by time if needed.
+
+    :param data_tables: message tables to index
+    :param bool all_messages: index and sort table of all messages
+    """
+    for data_table in data_tables:
+        create_indexes(data_table)
+    if all_messages:
+        all_table = _open_all_messages_table(hdf5file, group)
+        create_indexes(all_table)
+        if not _is_time_ordered(all_table):
+            _sort_by_time(hdf5file, all_table)
+
+
+def append_collated(hdf5file, group, values, message_type_dict,
+                    message_desc_dict, type_desc_dict, batch_size=None,
+                    filters=None, chunk_size=None, all_messages=False,
+                    layouts=None, row_counts=None):
+    """Append collated values to tables, create missing tables.
+
+    Tables are not indexed, so the function can be called for
+    consecutive pieces of a trace, see :func:`export` for parameters.
+    Pieces may not contain all value shapes of a message id, so layouts
+    of the whole trace should be given when a piece is appended.
+
+    :param layouts: map of message ids to value layouts of the whole
+        trace, layouts of the given values are used if not specified
+    :type layouts: dict
+    :param row_counts: map of message ids to number of values in the
+        whole trace
+    :type row_counts: dict
+    :return: list of tables the values were appended to
+    """
+    layouts = layouts if layouts else dict()
+    row_counts = row_counts if row_counts else dict()
+    data_tables = []
+    references = []
+    for message_id, values_list in values.items():
+        if not isinstance(values_list, vtc.ValueColumns):
+            values_list = vtc.ValueColumns(
+                [t for t, _ in values_list], [v for _, v in values_list])
+        value_shape, is_variable = (
+            layouts[message_id] if message_id in layouts
+            else value_layout(values_list.values))
+        data_table = _create_table(
+            hdf5file, group, message_id, message_type_dict[message_id],
+            message_desc_dict, type_desc_dict, filters, chunk_size,
+            row_counts.get(message_id, len(values_list.times)),
+            value_shape, is_variable)
+        if data_table is None:
+            continue
+        first_row = data_table.nrows
+        append_columns(data_table, values_list.times, values_list.values,
+                       batch_size)
+        data_tables.append(data_table)
+        if all_messages:
+            references.append((message_id, message_type_dict[message_id],
+                               first_row, values_list.times))
+    if all_messages:
+        _export_references(hdf5file, group, references, batch_size, filters)
+    return data_tables
+
+
 def export(hdf5file, group, values, message_type_dict,
-           message_desc_dict, type_desc_dict):
+           message_desc_dict, type_desc_dict, batch_size=None,
+           filters=None, chunk_size=None, index=False,
+           all_messages=False):
     """Export collated values into hdf5 file.
 
+    If requested, :const:`ALL_MESSAGES_TABLE` table with ``time``,
+    ``message_id``, ``type_id`` and ``row`` columns is created. It
+    references rows of message tables ordered by time and its time
+    column is always indexed.
+
     :param hdf5file: hdf5 file object
     :param group: group in which trace tables will be created
     :type group: str or hdf5 group
     :param values: map of message types to list of (timestamp, value)
+        or to :class:`~vartools.common.ValueColumns`
     :type values: dict
     :param message_type_dict:
     :type message_type_dict:
@@ -57,24 +563,207 @@ def export(hdf5file, group, values, message_type_dict,
     :type message_desc_dict:
     :param type_desc_dict:
     :type type_desc_dict:
+    :param int batch_size: number of rows appended to a table at once
+    :param filters: compression filters, see :func:`create_filters`
+    :type filters: :class:`tables.Filters`
+    :param int chunk_size: number of rows in a chunk, chosen by PyTables
+        from number of values if not specified
+    :param bool index: create indexes, see :func:`create_indexes`
+    :param bool all_messages: create table of all messages
     """
-    for message_id, values_list in values.items():
-        if message_id not in message_desc_dict:
-            _logger.error(
-                'No description for message id {}'.format(message_id))
-            continue
-        type_id = message_type_dict[message_id]
-        col_type = _get_col_type(type_id, type_desc_dict)
-        if not col_type:
-            continue
-        table_format = {'time': tables.Time64Col(pos=0),
-                        'value': col_type(pos=1)}
-        data_table = hdf5file.create_table(
-            group, message_desc_dict[message_id].name, table_format,
-            message_desc_dict[message_id].comment)
-        for time, value in values_list:
-            row = data_table.row
-            row['time'] = time
-            row['value'] = value
-            row.append()
-        data_table.flush()
+    data_tables = append_collated(
+        hdf5file, group, values, message_type_dict, message_desc_dict,
+        type_desc_dict, batch_size, filters, chunk_size, all_messages)
+    index_group(hdf5file, group, data_tables if index else [], all_messages)
+
+
+def _export_references(hdf5file, group, references, batch_size, filters):
+    """Write time ordered table of all messages."""
+    times = np.concatenate([np.asarray(t, dtype=np.float64)
+                            for _, _, _, t in references] + [[]])
+    all_table = _open_all_messages_table(hdf5file, group, filters, len(times))
+    message_ids = np.concatenate([np.full(len(t), i, dtype=np.uint8)
+                                  for i, _, _, t in references] + [[]])
+    type_ids = np.concatenate([np.full(len(t), i, dtype=np.uint8)
+                               for _, i, _, t in references] + [[]])
+    rows = np.concatenate([np.arange(r, r + len(t), dtype=np.int64)
+                           for _, _, r, t in references] + [[]])
+    order = np.argsort(times, kind='mergesort')
+    append_messages(all_table, times[order], message_ids[order],
+                    type_ids[order], rows[order], batch_size)
+
+
+class StreamingExporter:
+    """Export messages into tables while trace is being read.
+
+    Tables are created the first time a message id appears. Rows are
+    buffered in typed columns and written when the buffered size
+    exceeds the byte budget, so memory usage does not depend on trace
+    length. Since lengths of future arrays are unknown, array values
+    are always stored as variable length arrays. Table of all messages
+    is filled in trace order and sorted by time by :meth:`close`. If
+    times are converted, raw timestamps of all records are buffered and
+    converted at once on every flush.
+    """
+
+    #: Size of buffered reference to a value of table of all messages.
+    _REFERENCE_SIZE = sum(np.dtype(column.dtype).itemsize
+                          for column in _ALL_MESSAGES_FORMAT.values())
+    #: Size of buffered raw timestamp and message id of a record.
+    _RAW_TIME_SIZE = array('I').itemsize + array('h').itemsize
+
+    def __init__(self, hdf5file, group, message_desc_dict, type_desc_dict,
+                 buffer_size=None, batch_size=None, filters=None,
+                 chunk_size=None, index=False, all_messages=False,
+                 convert_times=None):
+        """Create exporter without tables.
+
+        :param hdf5file: hdf5 file object
+        :param group: group in which trace tables will be created
+        :type group: str or hdf5 group
+        :param message_desc_dict: map of message ids to descriptions
+        :type message_desc_dict: dict
+        :param type_desc_dict: map of type ids to type descriptions
+        :type type_desc_dict: dict
+        :param int buffer_size: byte budget of buffered rows
+        :param int batch_size: number of rows appended to a table at once
+        :param filters: compression filters, see :func:`create_filters`
+        :type filters: :class:`tables.Filters`
+        :param int chunk_size: number of rows in a chunk
+        :param bool index: create indexes when exporter is closed, see
+            :func:`create_indexes`
+        :param bool all_messages: create table of all messages, see
+            :func:`export`
+        :param convert_times: function that converts array of raw
+            timestamps of all records in trace order into times, see
+            :func:`vartools.timeutils.convert_times`
+        """
+        self._hdf5file = hdf5file
+        self._group = group
+        self._message_desc_dict = message_desc_dict
+        self._type_desc_dict = type_desc_dict
+        self._buffer_size = (buffer_size if buffer_size
+                             else DEFAULT_STREAMING_BUFFER_SIZE)
+        self._batch_size = batch_size
+        self._filters = filters
+        self._chunk_size = chunk_size
+        self._index = index
+        #: Map of message ids to tables, None for skipped ids.
+        self.tables = dict()
+        self._columns = dict()
+        self._row_sizes = dict()
+        self._row_counts = dict()
+        self._all_table = (_open_all_messages_table(hdf5file, group, filters)
+                           if all_messages else None)
+        self._references = [
+            vtmu.ColumnBuffer(_ALL_MESSAGES_FORMAT[name].dtype)
+            for name in ['time', 'message_id', 'type_id', 'row']]
+        self._convert_times = convert_times
+        self._timestamps = array('I')
+        self._message_ids = array('h')
+        self._buffered_size = 0
+
+    def _get_columns(self, message):
+        """Return time and value columns of message id or None."""
+        message_id = message.message_id
+        if message_id not in self.tables:
+            is_variable = np.ndim(message.value) > 0
+            data_table = _create_table(
+                self._hdf5file, self._group, message_id, message.type_id,
+                self._message_desc_dict, self._type_desc_dict, self._filters,
+                self._chunk_size, is_variable=is_variable)
+            self.tables[message_id] = data_table
+            if data_table is None:
+                return None
+            if is_variable or 'value' not in data_table.colnames:
+                value_dtype = np.dtype(object)
+            elif getattr(message.value, 'dtype', None) is not None \
+                    and message.value.dtype.names:
+                value_dtype = message.value.dtype
+            else:
+                value_dtype = data_table.dtype['value'].base
+            self._columns[message_id] = (vtmu.ColumnBuffer(_TIME_COL().dtype),
+                                         vtmu.ColumnBuffer(value_dtype))
+            self._row_sizes[message_id] = (
+                _TIME_COL().dtype.itemsize
+                + (0 if value_dtype == object else value_dtype.itemsize))
+            self._row_counts[message_id] = data_table.nrows
+        return self._columns.get(message_id)
+
+    def add(self, message, time=None):
+        """Buffer message value, flush buffers if budget is exhausted.
+
+        Arrays are buffered as separate objects, their size includes
+        size of the array object and of the data.
+
+        :param message: message with filled value
+        :type message: :class:`~vartools.common.TraceMessage`
+        :param time: time of message, timestamp is used if None;
+            ignored if times are converted on flush
+        """
+        columns = (None if message.value is None
+                   else self._get_columns(message))
+        if self._convert_times is not None:
+            self._timestamps.append(message.timestamp)
+            self._message_ids.append(
+                -1 if columns is None else message.message_id)
+            self._buffered_size += self._RAW_TIME_SIZE
+        if columns is None:
+            return
+        times, values = columns
+        time = message.timestamp if time is None else time
+        if self._convert_times is None:
+            times.append(time)
+        values.append(message.value)
+        self._buffered_size += self._row_sizes[message.message_id]
+        if isinstance(message.value, np.ndarray):
+            self._buffered_size += sys.getsizeof(message.value) \
+                + message.value.nbytes
+        if self._all_table is not None:
+            for column, value in zip(
+                    self._references,
+                    (time, message.message_id, message.type_id,
+                     self._row_counts[message.message_id] + len(values) - 1)):
+                column.append(value)
+            self._buffered_size += self._REFERENCE_SIZE
+        if self._buffered_size >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows into tables."""
+        id_times_dict = None
+        if self._convert_times is not None:
+            converted = self._convert_times(
+                np.frombuffer(self._timestamps, dtype=np.uintc))
+            message_ids = np.frombuffer(self._message_ids, dtype=np.short)
+            id_times_dict = vtmu.split_by_id(converted, message_ids)
+            reference_times = converted[message_ids >= 0]
+            self._timestamps = array('I')
+            self._message_ids = array('h')
+        for message_id, (times, values) in self._columns.items():
+            if not len(values):
+                continue
+            append_columns(self.tables[message_id],
+                           times.array if id_times_dict is None
+                           else id_times_dict[message_id],
+                           values.array, self._batch_size)
+            self._row_counts[message_id] += len(values)
+            times.clear()
+            values.clear()
+        if len(self._references[0]):
+            columns = [column.array for column in self._references]
+            if id_times_dict is not None:
+                columns[0] = reference_times
+            append_messages(self._all_table, *columns,
+                            batch_size=self._batch_size)
+            for column in self._references:
+                column.clear()
+        self._buffered_size = 0
+        self._hdf5file.flush()
+
+    def close(self):
+        """Write remaining rows and create indexes."""
+        self.flush()
+        index_group(self._hdf5file, self._group,
+                    [t for t in self.tables.values() if t is not None]
+                    if self._index else [], self._all_table is not None)
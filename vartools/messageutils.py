@@ -3,10 +3,17 @@
 # pylint: disable=W0212
 
 from future.builtins import dict
+import sys
 import struct
 import logging
+from array import array
 from collections import defaultdict
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 import vartools.common as vtc
 
 _NAME_FORMAT_DICT = {'Int8': 'b', 'Uint8': 'B', 'Int16': 'h', 'Uint16': 'H',
@@ -17,7 +24,60 @@ _EVENT_TYPE_FORMAT = 'I'
 _logger = logging.getLogger(__name__)
 
 
-def _unpack_with(message, struct_object):
+def _array_unpacker(struct_object, dtype=None):
+    """Create function that decodes array of struct values at once.
+
+    Data is decoded into :class:`numpy.ndarray` view over the data
+    buffer or into :class:`array.array` if NumPy is not installed.
+    Structures are decoded into structured arrays with the given dtype
+    or into lists of tuples without NumPy.
+    """
+    byte_order = struct_object.format[:1]
+    type_format = struct_object.format[1:]
+    if np is not None:
+        if dtype is None:
+            try:
+                dtype = np.dtype(struct_object.format)
+            except TypeError:
+                dtype = None
+        if dtype is not None and dtype.itemsize == struct_object.size:
+            return lambda data: np.frombuffer(data, dtype=dtype)
+    elif len(type_format) == 1 and type_format in 'bBhHiIqQfd' \
+            and array(type_format).itemsize == struct_object.size:
+        is_swapped = (byte_order == '<') != (sys.byteorder == 'little')
+
+        def unpack_array(data):
+            values = array(type_format, bytes(data))
+            if is_swapped:
+                values.byteswap()
+            return values
+        return unpack_array
+    iter_unpack = struct_object.iter_unpack
+    if _field_count(struct_object) > 1:
+        return lambda data: list(iter_unpack(data))
+    return lambda data: [v[0] for v in iter_unpack(data)]
+
+
+def _field_count(struct_object):
+    """Return number of values unpacked by struct object."""
+    return len(struct_object.unpack(bytes(struct_object.size)))
+
+
+def _value_unpacker(struct_object, dtype=None):
+    """Create function that decodes a single struct value.
+
+    Structures are decoded into :class:`numpy.void` records with the
+    given dtype or into tuples of all fields without NumPy.
+    """
+    if np is not None and dtype is not None:
+        return lambda data: np.frombuffer(data, dtype=dtype)[0]
+    unpack = struct_object.unpack
+    if _field_count(struct_object) > 1:
+        return unpack
+    return lambda data: unpack(data)[0]
+
+
+def _unpack_with(message, struct_object, dtype=None):
     """Unpack message data using unpacker object."""
     if not struct_object:
         return message
@@ -29,10 +89,11 @@ def _unpack_with(message, struct_object):
         _logger.error('Data size {0} is not divisible by POD size {1}'.format(
             message.size, struct_object.size))
     if message.size == struct_object.size:
-        value = struct_object.unpack(message.data)[0]
+        value = _value_unpacker(struct_object, dtype)(message.data)
     else:
-        value = [struct_object.unpack_from(message.data, offset)[0]
-                 for offset in range(0, message.size, struct_object.size)]
+        used_size = message.size - message.size % struct_object.size
+        value = _array_unpacker(struct_object, dtype)(
+            message.data[:used_size])
     return message._replace(value=value)
 
 
@@ -57,11 +118,90 @@ def fill_pod_value(message, is_little=True):
 def fill_custom_value(message, type_id_dict):
     """Unpack value using struct object stored in type dictionary."""
     if message.type_id in type_id_dict:
-        struct_object = type_id_dict[message.type_id].struct_object
-        return _unpack_with(message, struct_object)
+        type_desc = type_id_dict[message.type_id]
+        return _unpack_with(message, type_desc.struct_object, type_desc.dtype)
     return message
 
 
+def _decode_raw(_):
+    """Leave data of unknown types undecoded."""
+    return None
+
+
+class DecoderRegistry:
+    """Map ``(type_id, size)`` pairs onto specialized decoders.
+
+    Decoding of data with a given type and size never changes, so all
+    checks are done once when decoder is created. Decoders are cached
+    and the hot loop does a single lookup and call per message. Custom
+    type descriptions take precedence over POD formats, as in
+    :func:`fill_pod_value` followed by :func:`fill_custom_value`.
+    """
+
+    def __init__(self, type_desc_dict=None, is_little=True):
+        """Create empty registry.
+
+        :param type_desc_dict: map of type ids to type descriptions
+        :type type_desc_dict: dict
+        :param bool is_little: encoding of data, little or big endian.
+        """
+        self._type_desc_dict = type_desc_dict if type_desc_dict else dict()
+        self._pod_dict = (vtc.TYPE_ID_FORMAT_DICT_LE if is_little
+                          else vtc.TYPE_ID_FORMAT_DICT_BE)
+        self._decoders = dict()
+
+    def _get_struct(self, type_id):
+        """Return struct object that describes type or None."""
+        type_desc = self._type_desc_dict.get(type_id)
+        if type_desc and type_desc.struct_object:
+            return type_desc.struct_object
+        return self._pod_dict.get(type_id)
+
+    def _get_dtype(self, type_id):
+        """Return dtype of a type described by a structure or None."""
+        type_desc = self._type_desc_dict.get(type_id)
+        return type_desc.dtype if type_desc else None
+
+    def _create(self, type_id, size):
+        """Create decoder for data of given type and size."""
+        struct_object = self._get_struct(type_id)
+        if not struct_object:
+            return _decode_raw
+        if size < struct_object.size:
+            _logger.error('Data size {0} is smaller then POD size {1}'.format(
+                size, struct_object.size))
+            return _decode_raw
+        if size % struct_object.size != 0:
+            _logger.error('Data size {0} is not divisible by POD size {1}'
+                          .format(size, struct_object.size))
+        dtype = self._get_dtype(type_id)
+        if size == struct_object.size:
+            return _value_unpacker(struct_object, dtype)
+        unpack_array = _array_unpacker(struct_object, dtype)
+        used_size = size - size % struct_object.size
+        return lambda data: unpack_array(data[:used_size])
+
+    def get(self, type_id, size):
+        """Return decoder for data of given type and size.
+
+        Decoder takes message data and returns value or None if data
+        can not be decoded.
+        """
+        try:
+            return self._decoders[(type_id, size)]
+        except KeyError:
+            decoder = self._create(type_id, size)
+            self._decoders[(type_id, size)] = decoder
+            return decoder
+
+    def decode(self, message):
+        """Return message with filled value field."""
+        value = self.get(message.type_id, message.size)(message.data)
+        return vtc.TraceMessage(message.timestamp, message.size,
+                                message.message_id, message.type_id,
+                                message.data, value)
+
+
 def get_value_description(message, type_id_dict):
     """Return value description or None.
 
@@ -77,10 +217,7 @@ def get_value_description(message, type_id_dict):
 
 def data_to_text(data):
     """Convert binary data into textual representation."""
-    byte_list = []
-    for b in data:
-        byte_list.append('{:02x}'.format(ord(b)))
-    return ' '.join(byte_list)
+    return ' '.join('{:02x}'.format(b) for b in bytearray(data))
 
 
 def message_to_text(message, message_id_dict, type_id_dict):
@@ -93,6 +230,8 @@ def message_to_text(message, message_id_dict, type_id_dict):
         message_name = 'UknownMessage_{}'.format(message.message_id)
     if message.value is None:
         message_value = data_to_text(message.data)
+    elif hasattr(message.value, 'tolist'):
+        message_value = message.value.tolist()
     else:
         message_value = message.value
     value_desc = get_value_description(message, type_id_dict)
@@ -118,15 +257,242 @@ def collate_values(messages, timestamp_to_time=None):
     collated_values = defaultdict(list)
     message_type_dict = dict()
     for message in messages:
-        if message.value:
+        if message.value is not None:
             collated_values[message.message_id].append(
                 (timestamp_to_time(message.timestamp), message.value))
         if message.message_id in message_type_dict:
             if message.type_id != message_type_dict[message.message_id]:
                 _logger.error(
-                    'Different type ids correspond to the one message '
-                    'id'.format(message.type_id,
-                                message_type_dict[message.message_id]))
+                    'Different type ids {0} and {1} correspond to the message '
+                    'id {2}'.format(message.type_id,
+                                    message_type_dict[message.message_id],
+                                    message.message_id))
         else:
             message_type_dict[message.message_id] = message.type_id
     return collated_values, message_type_dict
+
+
+class ColumnBuffer:
+    """Growable typed array with amortized doubling of capacity.
+
+    Rows may be scalars or fixed shape arrays. Scalars of types known
+    to :mod:`array` are kept in :class:`array.array`, which appends
+    much faster than an element assignment of NumPy array. If a row
+    does not fit the array, other rows are kept in a NumPy array. If a
+    row with different shape is appended the buffer switches to
+    ``object`` dtype, so variable length arrays are kept as separate
+    arrays.
+    """
+
+    #: Capacity of a new buffer.
+    INITIAL_CAPACITY = 1024
+    #: Type codes of :mod:`array` used for scalar rows.
+    _ARRAY_TYPECODES = 'bBhHiIlLqQfd'
+
+    def __init__(self, dtype, shape=()):
+        """Create empty buffer for rows of given dtype and shape."""
+        self._dtype = np.dtype(dtype)
+        self._shape = tuple(shape)
+        self._values = None
+        self._data = None
+        self._size = 0
+        typecode = self._dtype.char
+        if not self._shape and typecode in self._ARRAY_TYPECODES \
+                and self._dtype.isnative \
+                and array(typecode).itemsize == self._dtype.itemsize:
+            self._values = array(typecode)
+        else:
+            self._data = np.empty((self.INITIAL_CAPACITY,) + self._shape,
+                                  dtype=self._dtype)
+
+    def __len__(self):
+        return len(self._values) if self._values is not None else self._size
+
+    def clear(self):
+        """Remove all rows, release memory of large buffers."""
+        self.__init__(self._dtype, self._shape)
+
+    def _convert_to_ndarray(self):
+        """Move scalar rows from :class:`array.array` to NumPy array."""
+        self._size = len(self._values)
+        self._data = np.empty(max(2 * self._size, self.INITIAL_CAPACITY),
+                              dtype=self._dtype)
+        self._data[:self._size] = np.frombuffer(self._values,
+                                                dtype=self._dtype)
+        self._values = None
+
+    def _convert_to_objects(self):
+        """Store every row as a separate object."""
+        data = np.empty(len(self._data), dtype=object)
+        for i in range(self._size):
+            data[i] = self._data[i]
+        self._data = data
+
+    def append(self, value):
+        """Add row to the end of buffer."""
+        if self._values is not None:
+            try:
+                self._values.append(value)
+                return
+            except (TypeError, OverflowError):
+                self._convert_to_ndarray()
+        if self._size == len(self._data):
+            self._data = np.concatenate((self._data,
+                                         np.empty_like(self._data)))
+        if self._data.dtype != object \
+                and np.shape(value) != self._data.shape[1:]:
+            self._convert_to_objects()
+        self._data[self._size] = value
+        self._size += 1
+
+    @property
+    def array(self):
+        """Filled part of the buffer."""
+        if self._values is not None:
+            return np.frombuffer(self._values, dtype=self._dtype).copy()
+        return self._data[:self._size]
+
+
+def split_by_id(values, message_ids):
+    """Split a column of all records into columns of message ids.
+
+    :param numpy.ndarray values: column of records in trace order
+    :param numpy.ndarray message_ids: message ids of the records,
+        records with negative ids are dropped
+    :return: map of message ids to parts of the column in trace order
+    :rtype: dict
+    """
+    order = np.argsort(message_ids, kind='stable')
+    ids, starts = np.unique(message_ids[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    return {int(message_id): values[order[start:end]]
+            for message_id, start, end in zip(ids, starts, ends)
+            if message_id >= 0}
+
+
+class ColumnarCollator:
+    """Collate message values into typed columns per message id.
+
+    Timestamps are stored as ``uint64`` (raw or unwrapped ticks) or
+    ``float64`` (converted time), values use native dtype of the
+    message type. Requires NumPy.
+    """
+
+    def __init__(self, type_desc_dict=None, convert_times=None):
+        """Create empty collator.
+
+        :param type_desc_dict: map of type ids to type descriptions,
+            used to find dtype of custom types
+        :type type_desc_dict: dict
+        :param convert_times: function that converts array of raw
+            timestamps of all records in trace order into times, see
+            :func:`vartools.timeutils.convert_times`; it is called once
+            by :meth:`columns`
+        """
+        self._registry = DecoderRegistry(type_desc_dict)
+        self._convert_times = convert_times
+        self._timestamps = array('I')
+        self._message_ids = array('h')
+        self._time_columns = dict()
+        self._value_columns = dict()
+        #: Map of message ids to type ids.
+        self.message_type_dict = dict()
+
+    def _value_dtype(self, type_id, value):
+        """Find native dtype of values of a type."""
+        if hasattr(value, 'dtype'):
+            if value.dtype.names:
+                return value.dtype
+            return value.dtype.newbyteorder('=')
+        struct_object = self._registry._get_struct(type_id)
+        if struct_object:
+            try:
+                return np.dtype(struct_object.format[1:])
+            except TypeError:
+                pass
+        return np.asarray(value).dtype
+
+    def _create_columns(self, message_id, type_id, time, value):
+        """Create time and value columns for a new message id."""
+        time_dtype = np.float64 if isinstance(time, float) else np.uint64
+        if self._convert_times is None:
+            self._time_columns[message_id] = ColumnBuffer(time_dtype)
+        self._value_columns[message_id] = ColumnBuffer(
+            self._value_dtype(type_id, value), np.shape(value))
+
+    def add(self, message, time=None):
+        """Append message value to the columns of its message id.
+
+        Messages without value are skipped, but their type is recorded.
+
+        :param message: message with filled value
+        :type message: :class:`~vartools.common.TraceMessage`
+        :param time: time of message, timestamp is used if None;
+            ignored if times are converted by :meth:`columns`
+        """
+        message_id = message.message_id
+        if self._convert_times is not None:
+            self._timestamps.append(message.timestamp)
+            self._message_ids.append(
+                -1 if message.value is None else message_id)
+        if message_id in self.message_type_dict:
+            if message.type_id != self.message_type_dict[message_id]:
+                _logger.error(
+                    'Different type ids {0} and {1} correspond to the message '
+                    'id {2}'.format(message.type_id,
+                                    self.message_type_dict[message_id],
+                                    message_id))
+        else:
+            self.message_type_dict[message_id] = message.type_id
+        if message.value is None:
+            return
+        time = message.timestamp if time is None else time
+        if message_id not in self._value_columns:
+            self._create_columns(message_id, message.type_id, time,
+                                 message.value)
+        if self._convert_times is None:
+            self._time_columns[message_id].append(time)
+        self._value_columns[message_id].append(message.value)
+
+    def columns(self):
+        """Return map of message ids to value columns.
+
+        :rtype: dict of :class:`~vartools.common.ValueColumns`
+        """
+        if self._convert_times is None:
+            id_times_dict = {message_id: column.array for message_id, column
+                             in self._time_columns.items()}
+        else:
+            id_times_dict = split_by_id(
+                self._convert_times(np.frombuffer(self._timestamps,
+                                                  dtype=np.uintc)),
+                np.frombuffer(self._message_ids, dtype=np.short))
+        return {message_id: vtc.ValueColumns(
+            id_times_dict[message_id], self._value_columns[message_id].array)
+                for message_id in self._value_columns}
+
+
+def collate_columns(messages, type_desc_dict=None, timestamp_to_time=None,
+                    convert_times=None):
+    """Collate messages values into typed columns.
+
+    Same as :func:`collate_values` but values of every message id are
+    stored in :class:`~vartools.common.ValueColumns` of NumPy arrays.
+
+    :param messages: an iterable that produce messages
+    :type messages: :class:`~vartools.common.TraceMessage` list
+    :param type_desc_dict: map of type ids to type descriptions
+    :type type_desc_dict: dict
+    :param convert_times: function that converts raw timestamps of all
+        messages at once, see :class:`ColumnarCollator`
+    :return: two maps of message ids to columns and to type id
+    :rtype: (dict, dict)
+    """
+    collator = ColumnarCollator(type_desc_dict, convert_times)
+    if timestamp_to_time:
+        for message in messages:
+            collator.add(message, timestamp_to_time(message.timestamp))
+    else:
+        for message in messages:
+            collator.add(message)
+    return collator.columns(), collator.message_type_dict
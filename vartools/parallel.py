@@ -0,0 +1,330 @@
+"""Multi-process decoding of a single large trace.
+
+Record boundaries are found once with a header only scan (see
+:mod:`vartools.traceindex`), the file is split into byte ranges that
+start and end at record boundaries and every range is decoded and
+collated in a separate process with :mod:`vartools.bulkreader`.
+
+:func:`decode_pipeline` passes decoded pieces of shards through a shared
+bounded queue to the calling process, which puts them back in trace
+order and is the only one that writes output, e.g. hdf5 tables that can
+not be written concurrently.
+:func:`trace_layouts` describes values of the whole trace from the
+index, so tables can be created for all pieces before they are decoded.
+"""
+
+import mmap
+import queue
+import logging
+import itertools
+from collections import defaultdict
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import vartools.common as vtc
+import vartools.bulkreader as vtbr
+import vartools.parser.utils as vtpu
+import vartools.traceindex as vtti
+
+#: Number of shards per worker, more shards balance load better.
+SHARDS_PER_WORKER = 4
+#: Number of records collated into one piece passed to writer.
+DEFAULT_PIECE_SIZE = 1 << 16
+#: Number of pieces per worker waiting for writer.
+DEFAULT_QUEUE_SIZE = 2
+#: Seconds a worker waits for space in a full queue or reorder buffer
+#: before it checks whether the writer has stopped.
+_PUT_TIMEOUT = 0.1
+
+_logger = logging.getLogger(__name__)
+
+
+def find_shards(trace_path, shard_count, endianess=None, index=None):
+    """Split trace into byte ranges aligned on record boundaries.
+
+    :param str trace_path: path to trace file
+    :param int shard_count: desired number of shards
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param index: record index, existing sidecar is loaded or index is
+        built if not specified, new index is not saved
+    :type index: :class:`~vartools.traceindex.TraceIndex`
+    :return: list of ``(start, end)`` offsets
+    """
+    if index is None:
+        index = vtti.load_or_build(trace_path, endianess, save=False)
+    record_count = len(index)
+    shard_count = max(1, min(shard_count, record_count))
+    boundaries = sorted(set(record_count * i // shard_count
+                            for i in range(shard_count + 1)))
+    return [(index.offset(start), index.offset(end))
+            for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def _element_size(type_id, type_desc_dict):
+    """Return size of a single value of a type or None if not known."""
+    type_desc = type_desc_dict.get(type_id)
+    if type_desc and type_desc.struct_object:
+        return type_desc.struct_object.size
+    struct_object = vtc.TYPE_ID_FORMAT_DICT_LE.get(type_id)
+    return struct_object.size if struct_object else None
+
+
+def trace_layouts(index, type_desc_dict=None, header_filter=None):
+    """Return layouts of values of all message ids of a trace.
+
+    Payload sizes are taken from index columns, neither headers nor
+    values are read from the trace. A payload of a single element is a
+    scalar value, longer payloads are arrays as in
+    :class:`~vartools.messageutils.DecoderRegistry`.
+
+    :param index: record index of the trace
+    :type index: :class:`~vartools.traceindex.TraceIndex`
+    :param type_desc_dict: map of type ids to type descriptions
+    :type type_desc_dict: dict
+    :param header_filter: records rejected by filter are skipped
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    :return: map of message ids to layouts, see
+        :func:`vartools.hdf5.value_layout`, and map of message ids to
+        number of records
+    :rtype: (dict, dict)
+    """
+    type_desc_dict = type_desc_dict if type_desc_dict else dict()
+    if not len(index):
+        return dict(), dict()
+    columns = {'timestamp': np.frombuffer(index.timestamps, dtype=np.uintc),
+               'size': np.frombuffer(index.sizes, dtype=np.ushort),
+               'message_id': np.frombuffer(index.message_ids, dtype=np.ubyte),
+               'type_id': np.frombuffer(index.type_ids, dtype=np.ubyte)}
+    if header_filter is not None:
+        mask = vtbr.header_mask(columns, header_filter)
+        columns = {name: column[mask] for name, column in columns.items()}
+    id_shapes_dict = defaultdict(set)
+    keys = ((columns['message_id'].astype(np.uint32) << 24)
+            | (columns['type_id'].astype(np.uint32) << 16) | columns['size'])
+    for key in np.unique(keys).tolist():
+        message_id, type_id, size = key >> 24, (key >> 16) & 0xff, \
+            key & 0xffff
+        element_size = _element_size(type_id, type_desc_dict)
+        if element_size and size > element_size:
+            id_shapes_dict[message_id].add((size // element_size,))
+        else:
+            id_shapes_dict[message_id].add(())
+    layouts = {message_id: (((), True) if len(shapes) > 1
+                            else (shapes.pop(), False))
+               for message_id, shapes in id_shapes_dict.items()}
+    counts = np.bincount(columns['message_id'])
+    row_counts = {message_id: int(counts[message_id])
+                  for message_id in layouts}
+    return layouts, row_counts
+
+
+def _put(piece_queue, piece, stop):
+    """Put piece into a bounded queue unless writer has stopped.
+
+    :return: False if writer has stopped
+    """
+    while not stop.is_set():
+        try:
+            piece_queue.put(piece, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _acquire_slot(slots, head, shard_index, stop):
+    """Wait for space in reorder buffer of writer.
+
+    Pieces of the shard that is being written, ``head``, go straight to
+    output and need no space.
+
+    :return: True if a slot was taken and must be released by writer
+    """
+    while not stop.is_set() and head.value != shard_index:
+        if slots.acquire(timeout=_PUT_TIMEOUT):
+            return True
+    return False
+
+
+def _iter_record_pieces(buffer, start, end, endianess, header_filter,
+                        piece_size):
+    """Yield records of a byte range in pieces of ``piece_size`` records.
+
+    The range is scanned in chunks of
+    :const:`~vartools.traceindex.SCAN_CHUNK_SIZE` bytes, so memory used
+    by record descriptions does not depend on the size of the range.
+    """
+    pending = []
+    pending_count = 0
+    position = start
+    while position < end:
+        chunk_end = min(position + vtti.SCAN_CHUNK_SIZE, end)
+        records, next_position = vtbr.scan_records(
+            buffer, endianess, position, chunk_end, final=chunk_end == end)
+        records = vtbr.filter_records(records, header_filter)
+        pending.append(records)
+        pending_count += len(records)
+        if pending_count >= piece_size:
+            records = np.concatenate(pending)
+            full_size = len(records) - len(records) % piece_size
+            for piece_start in range(0, full_size, piece_size):
+                yield records[piece_start:piece_start + piece_size]
+            pending = [records[full_size:]]
+            pending_count = len(pending[0])
+        if next_position == position:
+            _logger.error('Incomplete record at offset {}'.format(position))
+            break
+        position = next_position
+    if pending_count:
+        yield np.concatenate(pending)
+
+
+def _decode_shard_pieces(piece_queue, slots, head, stop, shard_index,
+                         trace_path, start, end, headers, event_format,
+                         endianess, header_filter, piece_size):
+    """Put collated pieces of one shard into queue.
+
+    Items of queue are ``(shard_index, piece_index, piece, slotted)``,
+    piece None marks the end of the shard. Decoding is abandoned when
+    the ``stop`` event is set by the writer.
+    """
+    piece_index = 0
+    try:
+        _, type_desc_dict = vtpu.parse_headers(headers,
+                                               event_format=event_format)
+        with open(trace_path, 'rb') as trace_file:
+            buffer = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for records in _iter_record_pieces(buffer, start, end, endianess,
+                                               header_filter, piece_size):
+                piece = vtbr.collate_records(
+                    vtbr.RecordBatch(buffer, records),
+                    type_desc_dict=type_desc_dict)
+                slotted = _acquire_slot(slots, head, shard_index, stop)
+                if stop.is_set() or not _put(
+                        piece_queue,
+                        (shard_index, piece_index, piece, slotted), stop):
+                    break
+                piece_index += 1
+        finally:
+            buffer.close()
+    finally:
+        _put(piece_queue, (shard_index, piece_index, None, False), stop)
+
+
+def _concatenate_values(value_arrays):
+    """Concatenate value columns, rows of different shape become objects."""
+    if len(set(a.shape[1:] for a in value_arrays)) == 1:
+        return np.concatenate(value_arrays)
+    values = np.empty(sum(len(a) for a in value_arrays), dtype=object)
+    values[:] = [row for a in value_arrays for row in a]
+    return values
+
+
+def merge_collated(shard_results, timestamp_to_time=None):
+    """Merge results of :func:`vartools.messageutils.collate_columns`.
+
+    Shards are expected in file order, so concatenation of per message
+    id columns keeps values in timestamp order.
+
+    :param shard_results: list of ``(id_columns_dict, message_type_dict)``
+    :param timestamp_to_time: function applied to merged timestamps
+    :return: same as :func:`vartools.messageutils.collate_columns`
+    """
+    id_parts_dict = defaultdict(list)
+    message_type_dict = dict()
+    for id_columns_dict, shard_type_dict in shard_results:
+        for message_id, columns in id_columns_dict.items():
+            id_parts_dict[message_id].append(columns)
+        for message_id, type_id in shard_type_dict.items():
+            if message_type_dict.setdefault(message_id, type_id) != type_id:
+                _logger.error(
+                    'Different type ids {0} and {1} correspond to the message '
+                    'id {2}'.format(type_id, message_type_dict[message_id],
+                                    message_id))
+    id_columns_dict = dict()
+    for message_id, parts in id_parts_dict.items():
+        times = np.concatenate([p.times for p in parts])
+        if timestamp_to_time:
+            times = np.array([timestamp_to_time(t) for t in times.tolist()])
+        id_columns_dict[message_id] = vtc.ValueColumns(
+            times, _concatenate_values([p.values for p in parts]))
+    return id_columns_dict, message_type_dict
+
+
+def decode_pipeline(trace_path, headers, event_format, workers, write,
+                    timestamp_to_time=None, endianess=None,
+                    header_filter=None, piece_size=None, queue_size=None,
+                    index=None):
+    """Decode trace in worker processes and write it in this process.
+
+    Workers put numbered pieces of shards into one bounded queue and
+    the writer keeps pieces that arrive ahead of their turn in a reorder
+    buffer, so shards are decoded concurrently and written in trace
+    order. Only ``workers * queue_size`` pieces of shards after the one
+    being written are buffered, a worker that runs further ahead
+    blocks. If ``write`` or a worker raises, the remaining workers are
+    stopped and the exception is raised again.
+
+    :param str trace_path: path to trace file
+    :param list headers: paths to headers with trace description
+    :param str event_format: valid ``struct`` format specifier
+    :param int workers: number of worker processes
+    :param write: function called with ``(id_columns_dict,
+        message_type_dict)`` of every piece, see
+        :func:`vartools.messageutils.collate_columns`
+    :param timestamp_to_time: function that converts timestamps
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param header_filter: records rejected by filter are skipped
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    :param int piece_size: number of records in a piece
+    :param int queue_size: number of pieces per worker decoded in advance
+    :param index: record index, see :func:`find_shards`
+    :type index: :class:`~vartools.traceindex.TraceIndex`
+    """
+    piece_size = piece_size if piece_size else DEFAULT_PIECE_SIZE
+    queue_size = queue_size if queue_size else DEFAULT_QUEUE_SIZE
+    shards = find_shards(trace_path, workers * SHARDS_PER_WORKER, endianess,
+                         index)
+    _logger.debug('Decoding {0} shards with {1} workers'.format(
+        len(shards), workers))
+    with Manager() as manager, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        stop = manager.Event()
+        piece_queue = manager.Queue(workers * queue_size)
+        slots = manager.BoundedSemaphore(workers * queue_size)
+        head = manager.Value('i', 0)
+        futures = [executor.submit(_decode_shard_pieces, piece_queue, slots,
+                                   head, stop, shard_index, trace_path,
+                                   start, end, headers, event_format,
+                                   endianess, header_filter, piece_size)
+                   for shard_index, (start, end) in enumerate(shards)]
+        pending = dict()
+        try:
+            for shard_index, future in enumerate(futures):
+                head.value = shard_index
+                for piece_index in itertools.count():
+                    while (shard_index, piece_index) not in pending:
+                        received, received_piece, piece, slotted = \
+                            piece_queue.get()
+                        if not received_piece:
+                            _logger.debug('Shard {} started'.format(received))
+                        if piece is None:
+                            _logger.debug(
+                                'Shard {} finished'.format(received))
+                        pending[received, received_piece] = piece, slotted
+                    piece, slotted = pending.pop((shard_index, piece_index))
+                    if slotted:
+                        slots.release()
+                    if piece is None:
+                        break
+                    write(*merge_collated([piece], timestamp_to_time))
+                future.result()
+        except BaseException:
+            _logger.debug('Stopping workers')
+            stop.set()
+            for future in futures:
+                future.cancel()
+            raise
@@ -0,0 +1,107 @@
+"""Persistent cache of parsed headers.
+
+Enums extracted from a header are pickled into the user cache directory
+under a name derived from the hash of header contents and of the parser
+code (see :func:`code_version`), so a header is parsed only once no
+matter how many traces are converted with it and a changed parser never
+reads results of an older one.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+import vartools
+
+#: Environment variable that overrides location of the cache.
+CACHE_DIR_VARIABLE = 'VARTOOLS_CACHE_DIR'
+
+_CACHE_SUFFIX = '.pickle'
+#: Directory with modules that produce cached data.
+_CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_code_version = None
+
+_logger = logging.getLogger(__name__)
+
+
+def get_cache_dir():
+    """Return cache directory of vartools, it may not exist yet.
+
+    :const:`CACHE_DIR_VARIABLE` environment variable is used if set,
+    otherwise ``vartools`` subdirectory of ``$XDG_CACHE_HOME`` or
+    ``~/.cache``.
+    """
+    path = os.environ.get(CACHE_DIR_VARIABLE)
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'vartools')
+
+
+def code_version():
+    """Return hash of vartools version and sources of the parser package.
+
+    Sources are read once per process. Only the version is used if they
+    can not be read, e.g. when the package is installed without sources.
+
+    :rtype: str
+    """
+    global _code_version  # pylint: disable=W0603
+    if _code_version is None:
+        digest = hashlib.sha256(vartools.__version__.encode('ascii'))
+        try:
+            for name in sorted(os.listdir(_CODE_DIR)):
+                if name.endswith('.py'):
+                    with open(os.path.join(_CODE_DIR, name), 'rb') \
+                            as source:
+                        digest.update(name.encode('utf-8'))
+                        digest.update(source.read())
+        except (IOError, OSError) as error:
+            _logger.warning('Can not read parser sources: {}'.format(error))
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def content_key(*contents):
+    """Return cache key of byte strings and parser code.
+
+    :rtype: str
+    """
+    digest = hashlib.sha256(code_version().encode('ascii'))
+    for content in contents:
+        digest.update('{}:'.format(len(content)).encode('ascii'))
+        digest.update(content)
+    return digest.hexdigest()
+
+
+def load(key):
+    """Return cached object or None if it is missing or unreadable."""
+    path = os.path.join(get_cache_dir(), key + _CACHE_SUFFIX)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (IOError, OSError, EOFError, ValueError, AttributeError,
+            ImportError, pickle.UnpicklingError) as error:
+        _logger.warning('Ignoring broken cache {0}: {1}'.format(path, error))
+        return None
+
+
+def store(key, value):
+    """Pickle object into cache, failures are logged and ignored."""
+    cache_dir = get_cache_dir()
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        handle, temp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(handle, 'wb') as cache_file:
+            pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(cache_dir, key + _CACHE_SUFFIX))
+    except (IOError, OSError, pickle.PicklingError) as error:
+        _logger.warning('Can not write cache: {}'.format(error))
@@ -3,6 +3,10 @@ import ply.lex as lex
 
 import vartools.common as vtc
 
+#: Pregenerated tables of the optimized lexer, delete the module after
+#: changing token rules and ply writes a new one on the next run.
+LEXTAB_MODULE = 'vartools.parser.enumlextab'
+
 
 class EnumLexer:
     """C++ header lexer for extracting contents of enum.
@@ -29,6 +33,9 @@ class EnumLexer:
         self._logger = logging.getLogger('EnumLexer')
         #: Store last one line comment to document identifiers.
         self.last_line_comment = None
+        if not kwargs.get('debug'):
+            kwargs.setdefault('optimize', True)
+            kwargs.setdefault('lextab', LEXTAB_MODULE)
         #: Actual lexer object.
         self.lexer = lex.lex(module=self, debuglog=self._logger, **kwargs)
 
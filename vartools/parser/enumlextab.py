@@ -0,0 +1,10 @@
+# enumlextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('ASSIGN', 'CLOSE_CURLY', 'CLOSE_PAREN', 'COMMA', 'ENUM', 'ID', 'INTEGER', 'NAMESPACE', 'NAMESPACE_SEPARATOR', 'OPEN_CURLY', 'OPEN_PAREN', 'SEMICOLON'))
+_lexreflags   = 64
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive', 'comment': 'exclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_MACROS>\\#.*)|(?P<t_LINE_COMMENT>//[\\*! ]*(.*))|(?P<t_ID>[a-zA-Z_][a-zA-Z_0-9]*)|(?P<t_HEX_INTEGER>0x[0-9a-f]+)|(?P<t_INTEGER>[0-9]+)|(?P<t_START_MULTILINE_COMMENT>/\\*)|(?P<t_CLOSE_PAREN>\\))|(?P<t_NAMESPACE_SEPARATOR>::)|(?P<t_OPEN_PAREN>\\()|(?P<t_ASSIGN>=)|(?P<t_CLOSE_CURLY>})|(?P<t_COMMA>,)|(?P<t_OPEN_CURLY>{)|(?P<t_SEMICOLON>;)', [None, ('t_MACROS', 'MACROS'), ('t_LINE_COMMENT', 'LINE_COMMENT'), None, ('t_ID', 'ID'), ('t_HEX_INTEGER', 'HEX_INTEGER'), ('t_INTEGER', 'INTEGER'), ('t_START_MULTILINE_COMMENT', 'START_MULTILINE_COMMENT'), (None, 'CLOSE_PAREN'), (None, 'NAMESPACE_SEPARATOR'), (None, 'OPEN_PAREN'), (None, 'ASSIGN'), (None, 'CLOSE_CURLY'), (None, 'COMMA'), (None, 'OPEN_CURLY'), (None, 'SEMICOLON')])], 'comment': [('(?P<t_comment_NON_ASTERISK>[^\\*]+)|(?P<t_comment_END_MULTILINE_COMMENT>\\*/)|(?P<t_comment_ASTERISK>\\*)', [None, ('t_comment_NON_ASTERISK', 'NON_ASTERISK'), ('t_comment_END_MULTILINE_COMMENT', 'END_MULTILINE_COMMENT'), ('t_comment_ASTERISK', 'ASTERISK')])]}
+_lexstateignore = {'INITIAL': ' \t\n', 'comment': ' \t\n'}
+_lexstateerrorf = {'INITIAL': 't_ANY_error', 'comment': 't_ANY_error'}
+_lexstateeoff = {}
@@ -1,11 +1,20 @@
+import os
+import pickle
 import logging
 
+import ply
 import ply.yacc as yacc
 from future.builtins import dict
 
 from vartools.parser.enumlexer import EnumLexer
+import vartools.parser.cache as vtpc
 import vartools.common as vtc
 
+#: Name of pickled parser tables in cache directory, formatted with
+#: parser code version (see :func:`vartools.parser.cache.code_version`)
+#: and ply version.
+TABLE_FILE_TEMPLATE = 'enumparser-{0}-ply{1}.tables'
+
 
 class EnumParser:
     """Parser of C++ headers that extracts information from enums.
@@ -47,10 +56,42 @@ class EnumParser:
         #: Lexer object.
         self.lexer = EnumLexer(debug=is_debug)
         #: Parser object.
-        self.parser = yacc.yacc(module=self, debuglog=self._logger)
+        self.parser = (yacc.yacc(module=self, debuglog=self._logger,
+                                 write_tables=False)
+                       if is_debug else self._load_parser())
         #: Keeps track of index inside enum statement.
         self.current_enum_index = 0
 
+    def _load_parser(self):
+        """Create parser from tables cached in user cache directory.
+
+        Tables are generated and pickled into the cache directory if they
+        are missing or do not match the grammar. A temporary file is
+        renamed so concurrent processes never read a partial file.
+        """
+        cache_dir = vtpc.get_cache_dir()
+        table_path = os.path.join(cache_dir, TABLE_FILE_TEMPLATE.format(
+            vtpc.code_version()[:16], ply.__version__))
+        if os.path.exists(table_path):
+            try:
+                return yacc.yacc(module=self, debug=False,
+                                 picklefile=table_path)
+            except (IOError, OSError, EOFError, ValueError,
+                    pickle.UnpicklingError) as error:
+                self._logger.warning('Regenerating broken parser tables: '
+                                     '{}'.format(error))
+        temp_path = '{0}.{1}'.format(table_path, os.getpid())
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            parser = yacc.yacc(module=self, debug=False, picklefile=temp_path)
+            os.replace(temp_path, table_path)
+            return parser
+        except (IOError, OSError) as error:
+            self._logger.warning('Can not cache parser tables: {}'.format(
+                error))
+        return yacc.yacc(module=self, debug=False, write_tables=False)
+
     def parse(self, data):
         """Parse a string.
 
@@ -0,0 +1,164 @@
+"""Fast extraction of enums from large C++ headers.
+
+:class:`EnumScanner` looks only for ``enum Name { ... };`` blocks with
+compiled regular expressions and skips everything else, so headers may
+contain structs, templates, operators and other constructs that
+:class:`~vartools.parser.enumparser.EnumParser` does not understand.
+Enum bodies with members that the scanner does not recognize are passed
+to the ply parser.
+"""
+
+import re
+import logging
+
+from future.builtins import dict
+
+import vartools.common as vtc
+
+#: Comments, literals and enum heads, other code is skipped.
+_HEADER_RE = re.compile(
+    r'//[\*! ]*(?P<line_comment>[^\n]*)'
+    r'|(?P<block_comment>/\*.*?\*/)'
+    r'|"(?:\\.|[^"\\\n])*"'
+    r"|'(?:\\.|[^'\\\n])*'"
+    r'|\benum\s+(?:(?:class|struct)\s+)?(?P<name>[A-Za-z_]\w*)'
+    r'\s*(?::\s*[\w:\s]+?)?\s*\{',
+    re.DOTALL)
+#: Enum member with preceding and following comments, the comment
+#: groups keep the last line comment and the last block comment.
+_MEMBER_RE = re.compile(
+    r'(?P<comments>(?:\s|//[\*! ]*(?P<line>[^\n]*)|(?P<block>/\*.*?\*/))*)'
+    r'(?:(?P<name>[A-Za-z_]\w*)\s*'
+    r'(?:=\s*(?P<value>0[xX][0-9a-fA-F]+|\d+)[uUlL]*\s*)?'
+    r'(?P<trailing>(?:\s|//[\*! ]*(?P<trailing_line>[^\n]*)'
+    r'|(?P<trailing_block>/\*.*?\*/))*))?'
+    r'(?P<end>[,}])',
+    re.DOTALL)
+_COMMENT_RE = re.compile(r'//[\*! ]*([^\n]*)|/\*.*?\*/', re.DOTALL)
+#: Skips enum body up to closing bracket.
+_CLOSE_RE = re.compile(r'(?:[^}/]|/(?![/*])|//[^\n]*|/\*.*?\*/)*\}',
+                       re.DOTALL)
+#: Lines of preprocessor directives, ignored like in the lexer.
+_MACRO_RE = re.compile(r'#[^\n]*')
+_IDENTIFIER_RE = re.compile(r'(?<!\w)[A-Za-z_]')
+
+
+class EnumScanner:
+    """Extract enums from C++ headers without parsing other code.
+
+    Produces the same :class:`~vartools.common.EnumList` structures as
+    :class:`~vartools.parser.enumparser.EnumParser`: the enum and every
+    member are described by the last one line comment before them.
+    """
+
+    def __init__(self):
+        #: Logger to output errors and warnings.
+        self._logger = logging.getLogger('EnumScanner')
+        self._parser = None
+
+    def parse(self, data):
+        """Return list of enums found in a string.
+
+        :param str data: C++ header
+        :rtype: list of :class:`~vartools.common.EnumList`
+        """
+        enums = []
+        comment = None
+        comment_end = 0
+        position = 0
+        while True:
+            match = _HEADER_RE.search(data, position)
+            if not match:
+                return enums
+            position = match.end()
+            if match.group('line_comment') is not None:
+                comment = match.group('line_comment')
+                comment_end = position
+            elif match.group('block_comment') is not None:
+                comment = ''
+                comment_end = position
+            elif match.group('name') is not None:
+                # identifiers between comment and enum name consume it
+                gap = _MACRO_RE.sub('', data[comment_end:match.start()])
+                if comment is None or _IDENTIFIER_RE.search(gap):
+                    comment = None
+                enum_comment = comment if comment else ''
+                members, position, comment = self._scan_body(data, position)
+                if members is None:
+                    members = self._parse_body(match.group('name'),
+                                               data[match.end():position])
+                if members is not None:
+                    enums.append(vtc.EnumList(
+                        match.group('name'), enum_comment, members=members,
+                        category=None))
+                comment_end = position
+            else:
+                comment = None
+                comment_end = position
+
+    def _scan_body(self, data, position):
+        """Scan enum members after opening curly bracket.
+
+        :return: members dictionary or None if the body contains
+            unsupported constructs, position after closing bracket and
+            comment not consumed by members
+        """
+        members = dict()
+        comment = None
+        index = 0
+        match_member = _MEMBER_RE.match
+        while True:
+            match = match_member(data, position)
+            if not match:
+                break
+            comments, line, block, name, value, trailing, trailing_line, \
+                trailing_block, end = match.groups()
+            if not name and end == ',':
+                break
+            position = match.end()
+            comment = _last_comment(comments, line, block, comment)
+            if name:
+                if value:
+                    index = (int(value[2:], 16) if value[:2] in ('0x', '0X')
+                             else int(value))
+                members[index] = vtc.Description(name,
+                                                 comment if comment else '')
+                index += 1
+                comment = _last_comment(trailing, trailing_line,
+                                        trailing_block, None)
+            if end == '}':
+                return members, position, comment
+        close = _CLOSE_RE.match(data, position)
+        if not close:
+            self._logger.error('Enum is not closed')
+            return None, len(data), None
+        return None, close.end(), None
+
+    def _parse_body(self, name, body):
+        """Parse enum body with ply parser.
+
+        :return: members dictionary or None if body can not be parsed
+        """
+        self._logger.debug('Parsing body of enum {} with ply'.format(name))
+        if self._parser is None:
+            import vartools.parser.enumparser as vtep
+            self._parser = vtep.EnumParser()
+        enums = self._parser.parse(
+            'enum {0} {{{1}}};'.format(name, body[:-1]))
+        if not enums:
+            self._logger.error('Can not parse enum {}'.format(name))
+            return None
+        return enums[0].members
+
+
+def _last_comment(comments, line, block, default):
+    """Return text of the last one line comment, empty for block comment.
+
+    Only the order of last line and block comments has to be checked.
+    """
+    if block is None:
+        return default if line is None else line
+    match = None
+    for match in _COMMENT_RE.finditer(comments):
+        pass
+    return match.group(1) if match.group(1) is not None else ''
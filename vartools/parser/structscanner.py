@@ -0,0 +1,141 @@
+"""Extraction of plain-old-data structures from C++ headers.
+
+:class:`StructScanner` looks for ``struct Name { ... };`` blocks the same
+way :class:`~vartools.parser.enumscanner.EnumScanner` looks for enums.
+Only structures with data members of fixed width types, other structures
+and fixed arrays of them are extracted, structures with methods, static
+members, bit fields or base classes are skipped.
+"""
+
+import re
+import logging
+
+import vartools.common as vtc
+
+#: Comments, literals and structure heads, other code is skipped.
+_HEADER_RE = re.compile(
+    r'//[\*! ]*(?P<line_comment>[^\n]*)'
+    r'|(?P<block_comment>/\*.*?\*/)'
+    r'|"(?:\\.|[^"\\\n])*"'
+    r"|'(?:\\.|[^'\\\n])*'"
+    r'|\benum\s+(?:class|struct)\b'
+    r'|\bstruct\s+(?P<name>[A-Za-z_]\w*)\s*(?:final\s*)?\{',
+    re.DOTALL)
+#: Comment, access specifier, data member or end of structure body.
+_MEMBER_RE = re.compile(
+    r'\s*(?:(?://[\*! ]*(?P<line>[^\n]*))'
+    r'|(?P<block>/\*.*?\*/)'
+    r'|(?:public|private|protected)\s*:(?!:)'
+    r'|(?:const\s+)?(?:struct\s+)?'
+    r'(?P<type>[A-Za-z_]\w*(?:\s*::\s*[A-Za-z_]\w*)*)'
+    r'\s+(?P<declarators>[A-Za-z_][\w\s\[\],]*);'
+    r'|(?P<end>\}))',
+    re.DOTALL)
+_DECLARATOR_RE = re.compile(r'\s*([A-Za-z_]\w*)\s*((?:\[\s*\d+\s*\]\s*)*)$')
+_DIMENSION_RE = re.compile(r'\d+')
+#: Tokens that change nesting level of curly brackets.
+_BLOCK_RE = re.compile(
+    r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+    r'|(?P<open>\{)|(?P<close>\})',
+    re.DOTALL)
+#: Lines of preprocessor directives, ignored like in the lexer.
+_MACRO_RE = re.compile(r'#[^\n]*')
+_IDENTIFIER_RE = re.compile(r'(?<!\w)[A-Za-z_]')
+
+
+class StructScanner:
+    """Extract plain-old-data structures from C++ headers.
+
+    The structure and every field are described by the last one line
+    comment before them, as enums and their members. Namespaces of
+    field types are dropped, so ``std::uint32_t`` is ``uint32_t``.
+    """
+
+    def __init__(self):
+        #: Logger to output errors and warnings.
+        self._logger = logging.getLogger('StructScanner')
+
+    def parse(self, data):
+        """Return list of structures found in a string.
+
+        :param str data: C++ header
+        :rtype: list of :class:`~vartools.common.StructList`
+        """
+        structs = []
+        comment = None
+        comment_end = 0
+        position = 0
+        while True:
+            match = _HEADER_RE.search(data, position)
+            if not match:
+                return structs
+            position = match.end()
+            if match.group('line_comment') is not None:
+                comment = match.group('line_comment')
+                comment_end = position
+            elif match.group('block_comment') is not None:
+                comment = ''
+                comment_end = position
+            elif match.group('name') is not None:
+                gap = _MACRO_RE.sub('', data[comment_end:match.start()])
+                if comment is None or _IDENTIFIER_RE.search(gap):
+                    comment = None
+                fields, position = self._scan_body(data, position)
+                if fields is None:
+                    self._logger.debug(
+                        'Structure {} is not plain old data, skipped'.format(
+                            match.group('name')))
+                else:
+                    structs.append(vtc.StructList(
+                        match.group('name'), comment if comment else '',
+                        fields))
+                comment = None
+                comment_end = position
+            else:
+                comment = None
+                comment_end = position
+
+    def _scan_body(self, data, position):
+        """Scan data members after opening curly bracket.
+
+        :return: list of fields or None if the body contains
+            unsupported constructs and position after closing bracket
+        """
+        fields = []
+        comment = None
+        while True:
+            match = _MEMBER_RE.match(data, position)
+            if not match:
+                return None, self._skip_body(data, position)
+            position = match.end()
+            if match.group('end'):
+                return fields, position
+            if match.group('line') is not None:
+                comment = match.group('line')
+            elif match.group('block') is not None:
+                comment = ''
+            elif match.group('type'):
+                type_name = re.split(r'\s*::\s*', match.group('type'))[-1]
+                for declarator in match.group('declarators').split(','):
+                    declarator_match = _DECLARATOR_RE.match(declarator)
+                    if not declarator_match:
+                        return None, self._skip_body(data, position)
+                    name, dimensions = declarator_match.groups()
+                    fields.append(vtc.FieldDescription(
+                        name, comment if comment else '', type_name,
+                        tuple(int(d) for d in
+                              _DIMENSION_RE.findall(dimensions))))
+                comment = None
+
+    def _skip_body(self, data, position):
+        """Return position after closing bracket of the body."""
+        depth = 1
+        for match in _BLOCK_RE.finditer(data, position):
+            if match.group('open'):
+                depth += 1
+            elif match.group('close'):
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        self._logger.error('Structure is not closed')
+        return len(data)
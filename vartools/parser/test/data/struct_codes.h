@@ -0,0 +1,50 @@
+#ifndef TRUNK_INCLUDE_STRUCT_CODES_H_
+#define TRUNK_INCLUDE_STRUCT_CODES_H_
+
+#include <cstdint>
+
+namespace geometry {
+
+// Point in a plane
+struct Point {
+  // horizontal coordinate
+  int16_t x;
+  // vertical coordinate
+  double y;
+};
+
+// Snapshot of a tracked object
+struct Sample final {
+ public:
+  std::uint8_t flags;
+  Point points[2];
+  geometry::Point origin;
+  float matrix[2][3], scale;
+  char name[5];
+  bool valid;
+};
+
+// Not plain old data
+struct Track {
+  int32_t length;
+  int32_t Length() const { return length; }
+};
+
+// GeometryMessageIds description
+enum GeometryMessageIds {
+  kMessageIdPosition,
+  kMessageIdSample,
+  kMessageIdPath,
+  kMessageIdTrack
+};
+
+// GeometryTypeIds description
+enum GeometryTypeIds {
+  kTypeIdPoint = 0x40,
+  kTypeIdSample,
+  kTypeIdTrack
+};
+
+}  // namespace geometry
+
+#endif  // TRUNK_INCLUDE_STRUCT_CODES_H_
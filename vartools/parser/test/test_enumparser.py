@@ -2,12 +2,26 @@
 
 from __future__ import print_function
 import os
+import sys
+import ctypes
+import struct
+import tempfile
+
+import numpy as np
+import ply.lex as lex
+import ply.yacc as yacc
 import tables
 
 import vartools.parser.enumparser as vtep
+import vartools.parser.enumlexer as vtel
+import vartools.parser.enumlextab as vtlt
+import vartools.parser.enumscanner as vtes
+import vartools.parser.cache as vtpc
 import vartools.parser.utils as vtpu
 import vartools.tracereader as vttr
 import vartools.messageutils as vtmu
+import vartools.bulkreader as vtbr
+import vartools.convert as vtcv
 import vartools.hdf5 as vthdf5
 
 #: Location of parser's test data.
@@ -101,3 +115,217 @@ def test_hdf5_export():
     vthdf5.export(h5file, trace_group, id_values_dict, message_type_dict,
                   message_desc_dict, type_desc_dict)
     h5file.close()
+
+
+def test_decoder_registry():
+    """Compare registry decoders with step by step value filling."""
+    _, type_desc_dict = vtpu.parse_headers(
+        [os.path.join(_DATA_PATH, 'trace_codes.h')], event_format='<i')
+    registry = vtmu.DecoderRegistry(type_desc_dict)
+    with open(os.path.join(_DATA_PATH, 'trace.bin'), 'rb') as trace_file:
+        for message in vttr.TraceReader(trace_file):
+            expected = vtmu.fill_custom_value(vtmu.fill_pod_value(message),
+                                              type_desc_dict)
+            assert registry.decode(message) == expected
+    assert registry.get(5, 4) is registry.get(5, 4)
+
+
+def _comparable(message_dict, type_dict):
+    """Replace struct objects in type descriptions with formats."""
+    return message_dict, {
+        k: v._replace(struct_object=v.struct_object.format
+                      if v.struct_object else None)
+        for k, v in type_dict.items()}
+
+
+def test_header_cache(cache_dir, monkeypatch):
+    """Check that parsed headers are cached and broken cache is ignored."""
+    header = os.path.join(_DATA_PATH, 'trace_codes.h')
+    expected = _comparable(*vtpu.parse_headers([header], use_cache=False,
+                                               event_format='<i'))
+    for _ in range(2):
+        assert _comparable(*vtpu.parse_headers(
+            [header], event_format='<i')) == expected
+    cache_files = [f for f in os.listdir(cache_dir) if f.endswith('.pickle')]
+    assert len(cache_files) == 1
+    with open(os.path.join(cache_dir, cache_files[0]), 'wb') as cache_file:
+        cache_file.write(b'broken')
+    assert _comparable(*vtpu.parse_headers(
+        [header], event_format='<i')) == expected
+    monkeypatch.setattr(vtpc, '_code_version', 'changed parser')
+    vtpu.parse_headers([header], event_format='<i')
+    assert len([f for f in os.listdir(cache_dir)
+                if f.endswith('.pickle')]) == 2
+
+
+def test_parser_tables(cache_dir):
+    """Check that cached tables are loaded and lexer tables are current."""
+
+    def generate(*_args, **_kwargs):
+        raise AssertionError('Tables are generated')
+
+    vtep.EnumParser()
+    table_files = [f for f in os.listdir(cache_dir) if f.endswith('.tables')]
+    assert len(table_files) == 1
+    table_path = os.path.join(cache_dir, table_files[0])
+    mtime = os.path.getmtime(table_path)
+    generators = yacc.LRGeneratedTable, lex._form_master_re
+    yacc.LRGeneratedTable = lex._form_master_re = generate
+    try:
+        vtep.EnumParser()
+    finally:
+        yacc.LRGeneratedTable, lex._form_master_re = generators
+    assert os.path.getmtime(table_path) == mtime
+    assert vtel.LEXTAB_MODULE in sys.modules
+    with tempfile.TemporaryDirectory() as temp_dir:
+        lex.lex(module=vtel.EnumLexer(debug=True), optimize=True,
+                lextab='fresh_lextab', outputdir=temp_dir)
+        with open(os.path.join(temp_dir, 'fresh_lextab.py')) as fresh_file:
+            fresh = {}
+            exec(fresh_file.read(), fresh)
+        for name in ['_lextokens', '_lexstatere', '_lexstateinfo',
+                     '_lexstateignore', '_lexstateerrorf']:
+            assert fresh[name] == getattr(vtlt, name)
+
+
+def test_enum_scanner():
+    """Compare scanner with parser and check that other code is skipped."""
+    for header in ['trace_codes.h', 'type_codes.h']:
+        code = open(os.path.join(_DATA_PATH, header)).read()
+        assert vtes.EnumScanner().parse(code) == vtep.EnumParser().parse(code)
+    code = '''
+// Point description
+struct Point { int x; int y; bool operator<(const Point& p) const; };
+template <typename T> T twice(T x) { return x << 1; }
+// Scanned description
+enum class ScannedIds : uint8_t {
+  kFirst = 0X10u,  // second
+  kSecond
+};
+const char* text = "enum Fake { kFake };";
+/* enum Commented { kCommented }; */
+// Parsed description
+enum ParsedIds { kA
+  // first
+  = 3, kB };
+'''
+    enums = vtes.EnumScanner().parse(code)
+    assert [(e.name, e.comment) for e in enums] \
+        == [('ScannedIds', 'Scanned description'),
+            ('ParsedIds', 'Parsed description')]
+    assert enums[0].members == {0x10: ('kFirst', ''), 0x11: ('kSecond',
+                                                             'second')}
+    assert enums[1].members == {3: ('kA', ''), 4: ('kB', 'first')}
+    lines = []
+    for i in range(10000):
+        lines.append('// Module{} description'.format(i))
+        lines.append('enum Module{}Events {{'.format(i))
+        lines.extend('  kModule{0}Event{1} = 0x{1:x},  // event {1}'.format(
+            i, j) for j in range(6))
+        lines.append('};')
+    scanner = vtes.EnumScanner()
+    enums = scanner.parse('\n'.join(lines))
+    assert scanner._parser is None
+    assert len(enums) == 10000
+
+
+def test_parallel_header_parsing():
+    """Compare parallel and serial parsing of headers."""
+    headers = [os.path.join(_DATA_PATH, h)
+               for h in ['trace_codes.h', 'type_codes.h', 'trace_codes.h']]
+    expected = _comparable(*vtpu.parse_headers(
+        headers, use_cache=False, event_format='<i'))
+    for use_cache in [False, True]:
+        assert _comparable(*vtpu.parse_headers(
+            headers, use_cache=use_cache, workers=2,
+            event_format='<i')) == expected
+
+
+def _table_bytes(h5file, group):
+    """Return map of table names to raw rows, nested rows have no lists."""
+    return {t.name: t.read().tobytes()
+            for t in h5file.list_nodes(group, classname='Table')}
+
+
+def _write_records(trace_file, records):
+    """Write records of ``(timestamp, message_id, type_id, data)``."""
+    for timestamp, message_id, type_id, data in records:
+        trace_file.write(struct.pack('<IHBB', timestamp, len(data),
+                                     message_id, type_id) + data)
+        trace_file.write(b'\0' * (-len(data) % 4))
+    trace_file.flush()
+
+
+def test_struct_types():
+    """Check layout of compiled structures, decoding and export."""
+    header = os.path.join(_DATA_PATH, 'struct_codes.h')
+    message_dict, type_dict = vtpu.parse_headers(
+        [header], use_cache=False, event_format='<i')
+    assert type_dict[0x42].struct_object is None
+    point_type, sample_type = type_dict[0x40], type_dict[0x41]
+    assert point_type.dtype.names == ('x', 'y')
+
+    class CPoint(ctypes.Structure):
+        _fields_ = [('x', ctypes.c_int16), ('y', ctypes.c_double)]
+
+    class CSample(ctypes.Structure):
+        _fields_ = [('flags', ctypes.c_uint8), ('points', CPoint * 2),
+                    ('origin', CPoint), ('matrix', ctypes.c_float * 3 * 2),
+                    ('scale', ctypes.c_float), ('name', ctypes.c_char * 5),
+                    ('valid', ctypes.c_bool)]
+
+    assert sample_type.dtype.itemsize == ctypes.sizeof(CSample)
+    assert sample_type.struct_object.size == ctypes.sizeof(CSample)
+    assert [sample_type.dtype.fields[n][1] for n in sample_type.dtype.names] \
+        == [getattr(CSample, n).offset for n, _ in CSample._fields_]
+    sample = CSample(3, (CPoint(1, 0.5), CPoint(-2, 1.5)), CPoint(7, 2.5),
+                     ((1, 2, 3), (4, 5, 6)), 0.25, b'abc', True)
+    sample_data = bytes(sample)
+    assert sample_type.struct_object.unpack(sample_data) \
+        == (3, 1, 0.5, -2, 1.5, 7, 2.5, 1, 2, 3, 4, 5, 6, 0.25, b'abc\0\0',
+            True)
+    points = [bytes(CPoint(i, i / 2.)) for i in range(4)]
+    records = [(10 * i, 0, 0x40, points[i]) for i in range(4)]
+    records += [(45, 1, 0x41, sample_data),
+                (50, 2, 0x40, b''.join(points[:2])),
+                (55, 3, 0x42, b'\x01\0\0\0'),
+                (60, 2, 0x40, b''.join(points[2:]))]
+    decode = vtmu.DecoderRegistry(type_dict).decode
+    with tempfile.NamedTemporaryFile(suffix='.bin') as trace_file, \
+            tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        _write_records(trace_file, records)
+        with open(trace_file.name, 'rb') as trace_stream:
+            messages = [decode(m) for m in vttr.TraceReader(trace_stream)]
+        assert messages[4].value['origin'].tolist() == (7, 2.5)
+        assert messages[4].value['matrix'].tolist() == [[1, 2, 3], [4, 5, 6]]
+        assert messages[5].value['y'].tolist() == [0, 0.5]
+        assert messages[6].value is None
+        with open(trace_file.name, 'rb') as trace_stream:
+            batch = next(vtbr.iter_batches(trace_stream))
+        indices, values = vtbr.decode_pod_values(
+            batch, type_desc_dict=type_dict)[(0x40, 16)]
+        assert indices.tolist() == [0, 1, 2, 3]
+        assert values['x'].tolist() == [0, 1, 2, 3]
+        with tables.open_file(output.name, mode='w') as h5file:
+            for group, workers in [('serial', None), ('parallel', 2)]:
+                with open(trace_file.name, 'rb') as trace_stream:
+                    vtcv.to_hdf5(h5file, [group], trace_stream,
+                                 headers=[header], workers=workers)
+            serial = _table_bytes(h5file, '/serial')
+            assert serial == _table_bytes(h5file, '/parallel')
+            assert 'Track' not in serial
+            sample_table = h5file.root.serial.Sample
+            assert sample_table.cols.value.points.y[0].tolist() == [0.5, 1.5]
+            assert sample_table.cols.value.name[0] == b'abc'
+            path_values = h5file.root.serial.Path.cols.value
+            assert path_values.x[:].tolist() == [[0, 1], [2, 3]]
+            assert np.all(h5file.root.serial.Position.cols.value.y[:]
+                          == [0, 0.5, 1, 1.5])
+            with open(trace_file.name, 'rb') as trace_stream:
+                vtcv.to_hdf5(h5file, ['streamed'], trace_stream,
+                             headers=[header], streaming=True)
+            streamed = _table_bytes(h5file, '/streamed')
+            assert streamed['Position'] == serial['Position']
+            assert streamed['Sample'] == serial['Sample']
+            assert vthdf5.check_schema(h5file, '/serial', message_dict,
+                                       type_dict)
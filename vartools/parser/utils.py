@@ -2,10 +2,20 @@
 
 import logging
 import struct
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from future.builtins import dict
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 import vartools.common as vtc
-import vartools.parser.enumparser as vtep
+import vartools.parser.enumscanner as vtes
+import vartools.parser.structscanner as vtss
+import vartools.parser.cache as vtpc
 
 #: Enum that does not belong to any category.
 UNKNOWN_CATEGORY_ID = 0
@@ -27,6 +37,24 @@ CATEGORY_MEMBER_PREFIX_DICT = {UNKNOWN_CATEGORY_ID: '',
                                TYPE_CATEGORY_ID: 'kTypeId',
                                EVENT_CATEGORY_ID: 'k{}Event'}
 
+#: Map fixed width types of structure fields onto ``struct`` format
+#: characters.
+FIELD_TYPE_FORMAT_DICT = {'int8_t': 'b', 'uint8_t': 'B',
+                          'int16_t': 'h', 'uint16_t': 'H',
+                          'int32_t': 'i', 'uint32_t': 'I',
+                          'int64_t': 'q', 'uint64_t': 'Q',
+                          'float': 'f', 'double': 'd',
+                          'bool': '?', 'char': 'c'}
+
+#: Distinguishes cached headers from caches of older formats.
+_HEADER_CACHE_TAG = b'enums structs'
+#: Map struct format characters onto NumPy type characters.
+_FORMAT_DTYPE_DICT = {'c': 'S1', 's': 'S'}
+
+#: Memory layout of a structure, ``items`` is a list of offsets and
+#: ``struct`` formats of fields with fixed width types.
+_StructLayout = namedtuple('_StructLayout', 'size alignment items dtype')
+
 _logger = logging.getLogger(__name__)
 
 
@@ -99,12 +127,130 @@ def create_message_id_dict(enums):
         overlapping_keys = enum.members.keys() & id_dict.keys()
         if overlapping_keys:
             _logger.error('Overlapping keys: {0}'.format(
-                ', '.join(overlapping_keys)))
+                ', '.join(str(k) for k in sorted(overlapping_keys))))
         id_dict.update(enum.members)
     return id_dict
 
 
-def create_type_id_dict(enums, event_format=None):
+def _field_layout(field, struct_dict, layouts, byte_order):
+    """Return layout of an element of a field and shape of the field.
+
+    Layout is None if type of the field is not supported.
+    """
+    type_format = FIELD_TYPE_FORMAT_DICT.get(field.type_name)
+    if type_format is None:
+        if field.type_name not in struct_dict:
+            return None, field.shape
+        return (_struct_layout(field.type_name, struct_dict, layouts,
+                               byte_order), field.shape)
+    shape = field.shape
+    if type_format == 'c' and shape:
+        # character arrays are strings
+        type_format = '{}s'.format(shape[-1])
+        shape = shape[:-1]
+    size = struct.calcsize('<' + type_format)
+    dtype = None
+    if np is not None:
+        dtype = np.dtype(byte_order + _FORMAT_DTYPE_DICT.get(
+            type_format[-1], type_format[-1]) + type_format[:-1])
+    return (_StructLayout(size, struct.calcsize('<' + type_format[-1]),
+                          [(0, type_format)], dtype), shape)
+
+
+def _struct_layout(name, struct_dict, layouts, byte_order):
+    """Compute C layout of a structure, None if it can not be compiled.
+
+    Fields are aligned on the size of their type as on all common ABIs,
+    structure size is padded to the largest alignment of its fields.
+    """
+    if name in layouts:
+        return layouts[name]
+    # recursive definitions fail
+    layouts[name] = None
+    if not struct_dict[name].fields:
+        _logger.error('No fields in structure {}'.format(name))
+        return None
+    offset = 0
+    alignment = 1
+    items = []
+    names, formats, offsets = [], [], []
+    for field in struct_dict[name].fields:
+        layout, shape = _field_layout(field, struct_dict, layouts, byte_order)
+        if layout is None:
+            _logger.error('Unsupported type {0} of field {1}.{2}'.format(
+                field.type_name, name, field.name))
+            return None
+        offset += -offset % layout.alignment
+        count = 1
+        for dimension in shape:
+            count *= dimension
+        for i in range(count):
+            items.extend((offset + i * layout.size + o, f)
+                         for o, f in layout.items)
+        names.append(field.name)
+        formats.append((layout.dtype, shape) if shape else layout.dtype)
+        offsets.append(offset)
+        offset += count * layout.size
+        alignment = max(alignment, layout.alignment)
+    size = offset + -offset % alignment
+    dtype = None
+    if np is not None:
+        dtype = np.dtype({'names': names, 'formats': formats,
+                          'offsets': offsets, 'itemsize': size})
+    layouts[name] = _StructLayout(size, alignment, items, dtype)
+    return layouts[name]
+
+
+def _struct_format(layout, byte_order):
+    """Return ``struct`` format with explicit padding of a layout."""
+    parts = []
+    position = 0
+    for offset, item_format in layout.items:
+        if offset > position:
+            parts.append('{}x'.format(offset - position))
+        parts.append(item_format)
+        position = offset + struct.calcsize('<' + item_format)
+    if layout.size > position:
+        parts.append('{}x'.format(layout.size - position))
+    runs = [(part, len(list(group)))
+            for part, group in itertools.groupby(parts)]
+    return byte_order + ''.join(
+        part if count == 1 or len(part) > 1 else '{0}{1}'.format(count, part)
+        for part, count in runs)
+
+
+def compile_structs(structs, byte_order=None, names=None):
+    """Compile structures into ``struct`` objects and NumPy dtypes.
+
+    Structures are laid out like C compilers do it for plain-old-data
+    structures without packing pragmas. ``struct`` objects unpack all
+    fields flattened in declaration order, dtypes keep nested fields
+    and arrays. Dtypes are None if NumPy is not installed.
+
+    :param structs: list of structures found by
+        :class:`~vartools.parser.structscanner.StructScanner`
+    :type structs: list of :class:`~vartools.common.StructList`
+    :param str byte_order: ``<`` or ``>``, little endian by default
+    :param names: names of structures to compile, all if None
+    :return: map of structure names to ``(struct_object, dtype)``,
+        structures with unsupported fields are left out
+    :rtype: dict
+    """
+    byte_order = byte_order if byte_order else vtc.DEFAULT_ENDIANESS
+    struct_dict = {s.name: s for s in structs}
+    names = struct_dict if names is None else set(names) & set(struct_dict)
+    layouts = dict()
+    compiled = dict()
+    for name in names:
+        layout = _struct_layout(name, struct_dict, layouts, byte_order)
+        if layout is not None:
+            compiled[name] = (
+                struct.Struct(_struct_format(layout, byte_order)),
+                layout.dtype)
+    return compiled
+
+
+def create_type_id_dict(enums, event_format=None, structs=None):
     """Create dictionary with type id descriptions.
 
     It is assumed that some types contain event codes. This function
@@ -113,11 +259,24 @@ def create_type_id_dict(enums, event_format=None):
     that if there is a type with the name ``SomethingEvents`` then
     enum with name ``Something`` contains event codes.
 
+    Types with the name of a structure, e.g. ``kTypeIdPosition`` and
+    ``struct Position``, are decoded with the compiled structure, see
+    :func:`compile_structs`. Byte order of structures is taken from
+    the event format.
+
     :param enums: list of enums processed by :func:`clean_enums`
     :type enums: list of :class:`EnumList`
     :param str event_format: ``struct`` format string to parse event codes
+    :param structs: list of structures
+    :type structs: list of :class:`~vartools.common.StructList`
 
     """
+    byte_order = (event_format[0] if event_format
+                  and event_format[0] in '<>' else None)
+    compiled = compile_structs(
+        structs if structs else [], byte_order,
+        [d.name for e in enums if e.category == TYPE_CATEGORY_ID
+         for d in e.members.values()])
     # construct type dict
     type_dict = dict()
     for e in enums:
@@ -126,15 +285,17 @@ def create_type_id_dict(enums, event_format=None):
         overlapping_keys = e.members.keys() & type_dict.keys()
         if overlapping_keys:
             _logger.error('Overlapping keys: {0}'.format(
-                ', '.join(overlapping_keys)))
+                ', '.join(str(k) for k in sorted(overlapping_keys))))
         for type_id, desc in e.members.items():
-            struct_object = None
+            struct_object, dtype = None, None
             if event_format and desc.name.endswith(
                     CATEGORY_SUFFIX_DICT[EVENT_CATEGORY_ID]):
                 struct_object = struct.Struct(event_format)
+            elif desc.name in compiled:
+                struct_object, dtype = compiled[desc.name]
             type_desc = vtc.TypeDescription(
-                name=desc.name, comment=desc.comment,
-                codes=dict(), struct_object=struct_object)
+                name=desc.name, comment=desc.comment, codes=dict(),
+                struct_object=struct_object, dtype=dtype)
             type_dict[type_id] = type_desc
     # fill codes
     for e in enums:
@@ -148,19 +309,69 @@ def create_type_id_dict(enums, event_format=None):
     return type_dict
 
 
-def parse_headers(headers, **kwargs):
+def _parse_header(header, use_cache=True, scanner=None,
+                  struct_scanner=None):
+    """Return cleaned enums and structures of a header.
+
+    See :func:`parse_headers`.
+    """
+    with open(header, 'rb') as header_file:
+        header_code = header_file.read()
+    key = (vtpc.content_key(_HEADER_CACHE_TAG, header_code) if use_cache
+           else None)
+    parsed = vtpc.load(key) if use_cache else None
+    if parsed is None:
+        scanner = scanner if scanner else vtes.EnumScanner()
+        struct_scanner = (struct_scanner if struct_scanner
+                          else vtss.StructScanner())
+        code = header_code.decode()
+        parsed = (clean_enums(scanner.parse(code)),
+                  struct_scanner.parse(code))
+        if use_cache:
+            vtpc.store(key, parsed)
+    return parsed
+
+
+def parse_headers(headers, use_cache=True, workers=None, **kwargs):
     """Parse headers and return message_id and type_id dictionaries.
 
+    Enums are extracted with
+    :class:`~vartools.parser.enumscanner.EnumScanner`, cleaned enums of
+    every header are cached by header contents, see
+    :mod:`vartools.parser.cache`. Structures are extracted with
+    :class:`~vartools.parser.structscanner.StructScanner` and cached
+    together with enums. Type descriptions are created from cached
+    enums and structures, so event format does not invalidate the cache.
+
+    Headers can be parsed by a pool of processes, enums are merged in
+    the order of headers, so the result does not depend on number of
+    workers.
+
     :param headers: list of paths to headers
     :type headers: str list
+    :param bool use_cache: read and store enums in the cache
+    :param int workers: parse headers in that many processes
     :return: message_id and type_id dictionaries
     :rtype: (dict, dict)
     """
-    parser = vtep.EnumParser()
     enum_lists = []
-    for header in headers:
-        header_code = open(header).read()
-        enum_lists.extend(clean_enums(parser.parse(header_code)))
+    struct_lists = []
+    if workers and workers > 1 and len(headers) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for header_enums, header_structs in executor.map(
+                    _parse_header, headers,
+                    [use_cache] * len(headers)):
+                enum_lists.extend(header_enums)
+                struct_lists.extend(header_structs)
+    else:
+        scanner = vtes.EnumScanner()
+        struct_scanner = vtss.StructScanner()
+        for header in headers:
+            header_enums, header_structs = _parse_header(
+                header, use_cache, scanner, struct_scanner)
+            enum_lists.extend(header_enums)
+            struct_lists.extend(header_structs)
     message_dict = create_message_id_dict(enum_lists)
-    type_dict = create_type_id_dict(enum_lists, **kwargs)
+    type_dict = create_type_id_dict(enum_lists, structs=struct_lists,
+                                    **kwargs)
     return message_dict, type_dict
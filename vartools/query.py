@@ -0,0 +1,73 @@
+"""Time range queries on exported traces.
+
+Queries are evaluated with :meth:`tables.Table.get_where_list`, so they
+use indexes created by :func:`vartools.hdf5.create_indexes` and read only
+rows of the requested window. Tables without index are scanned.
+"""
+
+# pylint: disable=W0212
+
+import logging
+
+import numpy as np
+import tables
+
+import vartools.common as vtc
+import vartools.hdf5 as vthdf5
+
+_WINDOW_CONDITION = '(time >= t0) & (time < t1)'
+
+_logger = logging.getLogger(__name__)
+
+
+def _read_values(data_table, coordinates):
+    """Read values of rows with given coordinates."""
+    if 'value' in data_table.colnames:
+        return data_table.read_coordinates(coordinates, field='value')
+    if 'value_array' not in data_table.attrs:
+        return data_table.read_coordinates(coordinates)
+    value_array = data_table._v_parent._f_get_child(
+        data_table.attrs.value_array)
+    values = np.empty(len(coordinates), dtype=object)
+    values[:] = [value_array[c] for c in coordinates.tolist()]
+    return values
+
+
+def read_window(h5file, group, message_names, t0, t1):
+    """Read values of messages with time in ``[t0, t1)``.
+
+    :param h5file: hdf5 file object
+    :param group: trace group
+    :type group: str or hdf5 group
+    :param message_names: names of message tables, all message tables
+        of the group are read if None; values of
+        :const:`~vartools.hdf5.ALL_MESSAGES_TABLE` are its records
+    :param t0: start of the window
+    :param t1: end of the window, not included
+    :return: map of message names to
+        :class:`~vartools.common.ValueColumns`, values of variable length
+        arrays are in an object array
+    :rtype: dict
+    """
+    group = h5file.get_node(group)
+    if message_names is None:
+        message_names = [t.name for t in group._f_iter_nodes('Table')
+                         if t.name != vthdf5.ALL_MESSAGES_TABLE]
+    condvars = {'t0': t0, 't1': t1}
+    name_columns_dict = dict()
+    for name in message_names:
+        if name not in group:
+            _logger.error('No table {0} in {1}'.format(
+                name, group._v_pathname))
+            continue
+        data_table = group._f_get_child(name)
+        if not isinstance(data_table, tables.Table):
+            continue
+        if not data_table.cols.time.is_indexed:
+            _logger.debug('Table {} is not indexed, scanning'.format(name))
+        coordinates = data_table.get_where_list(
+            _WINDOW_CONDITION, condvars, sort=True)
+        name_columns_dict[name] = vtc.ValueColumns(
+            data_table.read_coordinates(coordinates, field='time'),
+            _read_values(data_table, coordinates))
+    return name_columns_dict
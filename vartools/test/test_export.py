@@ -0,0 +1,334 @@
+"""Export traces into hdf5 files and query exported tables."""
+
+import os
+import shutil
+import struct
+import _thread
+import tempfile
+import threading
+
+import numpy as np
+import tables
+
+import vartools.convert as vtcv
+import vartools.hdf5 as vthdf5
+import vartools.query as vtq
+import vartools.traceindex as vtti
+
+#: Location of test data with headers that describe traces.
+PARSER_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'parser',
+    'test', 'data')
+#: Headers with descriptions of test traces.
+HEADERS = [os.path.join(PARSER_DATA_PATH, 'trace_codes.h')]
+#: Sample trace described by :const:`HEADERS`.
+TRACE_PATH = os.path.join(PARSER_DATA_PATH, 'trace.bin')
+#: Map group names to options of collating and streaming export.
+EXPORT_MODES = {'collated': {'streaming': False},
+                'streamed': {'streaming': True}}
+#: Map group names to options of serial and parallel decoding.
+DECODE_MODES = {'serial': {'workers': None}, 'parallel': {'workers': 2}}
+
+
+def _export(h5file, trace_path, modes, **kwargs):
+    """Export trace into a group per mode.
+
+    :param dict modes: map of group names to options of the mode
+    :param kwargs: options common for all modes
+    """
+    for group, options in modes.items():
+        with open(trace_path, 'rb') as trace_file:
+            vtcv.to_hdf5(h5file, [group], trace_file, headers=HEADERS,
+                         **options, **kwargs)
+
+
+def _read_tables(h5file, group):
+    """Return map of table names to lists of rows."""
+    return {t.name: t.read().tolist()
+            for t in h5file.list_nodes(group, classname='Table')}
+
+
+def test_streaming_export():
+    """Compare streaming export that flushes often with normal export."""
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        with tables.open_file(output.name, mode='w') as h5file:
+            _export(h5file, TRACE_PATH, EXPORT_MODES, buffer_size=100,
+                    batch_size=7)
+            collated = _read_tables(h5file, '/collated')
+            assert collated
+            assert collated == _read_tables(h5file, '/streamed')
+            assert len(collated['Info']) > 7
+
+
+def test_compressed_export():
+    """Check that filters, chunk size and expected rows are applied."""
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        with tables.open_file(output.name, mode='w') as h5file:
+            with open(TRACE_PATH, 'rb') as trace_file:
+                vtcv.to_hdf5(h5file, ['trace'], trace_file, headers=HEADERS,
+                             complib='zlib', complevel=9, chunk_size=16)
+            table = h5file.root.trace.Info
+            assert table.filters.complib == 'zlib'
+            assert table.filters.complevel == 9
+            assert table.filters.shuffle
+            assert table.chunkshape == (16,)
+    filters = vthdf5.create_filters('no-such-library', 1)
+    assert filters.complib == 'zlib'
+    assert vthdf5.create_filters() is None
+
+
+def test_read_window():
+    """Compare indexed time window queries with table scans."""
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        with tables.open_file(output.name, mode='w') as h5file:
+            with open(TRACE_PATH, 'rb') as trace_file:
+                vtcv.to_hdf5(h5file, ['trace'], trace_file, headers=HEADERS,
+                             index=True)
+            table = h5file.root.trace.Info
+            assert table.cols.time.is_indexed
+            assert table.cols.time.index.is_csi
+            times = table.col('time')
+            t0, t1 = times[len(times) // 4], times[len(times) // 2]
+            window = vtq.read_window(h5file, '/trace', ['Info'], t0, t1)
+            expected = table.read_where('(time >= t0) & (time < t1)')
+            assert list(window['Info'].times) == list(expected['time'])
+            assert list(window['Info'].values) == list(expected['value'])
+            window = vtq.read_window(h5file, '/trace', None, t0, t1)
+            assert 'Info' in window
+
+
+def test_append_export():
+    """Extend groups with records appended to a growing trace."""
+    with open(TRACE_PATH, 'rb') as trace_file:
+        data = trace_file.read()
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output, \
+            tempfile.NamedTemporaryFile() as growing:
+        with tables.open_file(output.name, mode='w') as h5file:
+            with open(TRACE_PATH, 'rb') as trace_file:
+                vtcv.to_hdf5(h5file, ['expected'], trace_file,
+                             headers=HEADERS)
+            expected = _read_tables(h5file, '/expected')
+            for start, end in [(0, len(data) // 3 + 1),
+                               (len(data) // 3 + 1, len(data)), (0, 0)]:
+                growing.write(data[start:end])
+                growing.flush()
+                _export(h5file, growing.name, EXPORT_MODES, append=True)
+            assert _read_tables(h5file, '/collated') == expected
+            assert _read_tables(h5file, '/streamed') == expected
+            assert h5file.root.collated._v_attrs.trace_offset == len(data)
+
+
+def test_append_incomplete_record():
+    """Resume reading of a trace that ended with an incomplete record."""
+    data = b''.join(struct.pack('<IHBBi', i, 4, 1, 5, i) for i in range(40))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            for start, end in [(0, 20 * 12 + 6), (20 * 12 + 6, len(data))]:
+                with open(trace_path, 'ab') as trace_file:
+                    trace_file.write(data[start:end])
+                _export(h5file, trace_path, DECODE_MODES, append=True)
+                for group in DECODE_MODES:
+                    assert h5file.get_node('/', group)._v_attrs.trace_offset \
+                        == end // 12 * 12
+            for group in DECODE_MODES:
+                table = h5file.get_node('/', group).Info
+                assert table.col('value').tolist() == list(range(40))
+
+
+def test_interrupted_follow():
+    """Store rows and offset when following of a trace is interrupted."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        shutil.copy(TRACE_PATH, trace_path)
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            with open(trace_path, 'rb') as trace_file:
+                vtcv.to_hdf5(h5file, ['expected'], trace_file,
+                             headers=HEADERS)
+            for _ in range(2):
+                interrupt = threading.Timer(0.5, _thread.interrupt_main)
+                interrupt.start()
+                try:
+                    with open(trace_path, 'rb') as trace_file:
+                        vtcv.to_hdf5(h5file, ['followed'], trace_file,
+                                     headers=HEADERS, follow=True,
+                                     append=True, index=True)
+                except KeyboardInterrupt:
+                    pass
+                else:
+                    assert False, 'Following was not interrupted'
+                finally:
+                    interrupt.join()
+            assert _read_tables(h5file, '/followed') \
+                == _read_tables(h5file, '/expected')
+            assert h5file.root.followed._v_attrs.trace_offset \
+                == os.path.getsize(trace_path)
+            assert h5file.root.followed.Info.cols.time.is_indexed
+
+
+def test_all_messages_table():
+    """Check that table of all messages references message tables."""
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        with tables.open_file(output.name, mode='w') as h5file:
+            _export(h5file, TRACE_PATH, EXPORT_MODES, buffer_size=100,
+                    all_messages=True)
+            for group in EXPORT_MODES:
+                group = h5file.get_node('/', group)
+                id_table_dict = {
+                    t.attrs.message_id: t
+                    for t in h5file.list_nodes(group, classname='Table')
+                    if 'message_id' in t.attrs}
+                all_table = group._f_get_child(vthdf5.ALL_MESSAGES_TABLE)
+                assert all_table.cols.time.is_indexed
+                assert all_table.nrows \
+                    == sum(t.nrows for t in id_table_dict.values())
+                assert sorted(all_table.col('time')) == sorted(
+                    t for data_table in id_table_dict.values()
+                    for t in data_table.col('time'))
+                for record in all_table:
+                    data_table = id_table_dict[record['message_id']]
+                    assert data_table.attrs.type_id == record['type_id']
+                    assert data_table[record['row']]['time'] \
+                        == record['time']
+
+
+def test_parallel_export():
+    """Compare export of a pipeline with serial export."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        shutil.copy(TRACE_PATH, trace_path)
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            _export(h5file, trace_path, DECODE_MODES, index=True,
+                    all_messages=True)
+            assert _read_tables(h5file, '/serial') \
+                == _read_tables(h5file, '/parallel')
+            assert h5file.root.parallel.Info.cols.time.is_indexed
+        assert not os.path.exists(vtti.index_path(trace_path))
+
+
+def test_parallel_array_export():
+    """Export arrays whose length changes between shards in parallel."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with open(trace_path, 'wb') as trace_file:
+            for i in range(16):
+                length = 10 if i < 8 else 20
+                trace_file.write(struct.pack(
+                    '<IHBB{}i'.format(length), i, 4 * length, 1, 5,
+                    *range(i, i + length)))
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            _export(h5file, trace_path, DECODE_MODES)
+            values = [[list(v) for v in h5file.get_node(
+                '/{}/Info_values'.format(group))]
+                for group in DECODE_MODES]
+            assert values[0] == values[1]
+            assert [len(v) for v in values[1]] == [10] * 8 + [20] * 8
+            assert h5file.root.parallel.Info.nrows == 16
+
+
+def test_unwrapped_export():
+    """Check that unwrapped tick counts are stored exactly."""
+    period = 1 << 32
+    raw = [period - 300, period - 200, period - 100, 5, 100, period - 50, 200]
+    expected = [period - 300, period - 200, period - 100, period + 5,
+                period + 100, period - 50, period + 200]
+    data = b''.join(struct.pack('<IHBBi', timestamp, 4, 1, 5, i)
+                    for i, timestamp in enumerate(raw))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            for start, end in [(0, 4 * 12), (4 * 12, len(data))]:
+                with open(trace_path, 'ab') as trace_file:
+                    trace_file.write(data[start:end])
+                _export(h5file, trace_path, EXPORT_MODES,
+                        unwrap_timestamps=True, append=True,
+                        all_messages=True)
+            for group in EXPORT_MODES:
+                table = h5file.get_node('/', group).Info
+                assert table.col('time').tolist() == expected
+                all_table = h5file.get_node('/', group)._f_get_child(
+                    vthdf5.ALL_MESSAGES_TABLE)
+                assert sorted(all_table.col('time').tolist()) \
+                    == sorted(expected)
+                assert np.array_equal(table.col('value'),
+                                      np.arange(len(raw)))
+
+
+def test_all_messages_order():
+    """Sort table of all messages with late records of several flushes."""
+    period = 1 << 32
+    raw = [period - 300 + 10 * i for i in range(20)] \
+        + [5 + 10 * i for i in range(20)]
+    raw[25] = period - 40
+    data = b''.join(struct.pack('<IHBBi', timestamp, 4, 1 + i % 2, 5, i)
+                    for i, timestamp in enumerate(raw))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with open(trace_path, 'wb') as trace_file:
+            trace_file.write(data)
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            _export(h5file, trace_path, EXPORT_MODES, buffer_size=200,
+                    unwrap_timestamps=True, all_messages=True)
+            for group in EXPORT_MODES:
+                group = h5file.get_node('/', group)
+                all_table = group._f_get_child(vthdf5.ALL_MESSAGES_TABLE)
+                times = all_table.col('time')
+                assert len(times) == len(raw)
+                assert np.all(times[1:] >= times[:-1])
+                assert all_table.cols.time.is_indexed
+                name_dict = {t.attrs.message_id: t for t in
+                             h5file.list_nodes(group, classname='Table')
+                             if 'message_id' in t.attrs}
+                for record in all_table:
+                    assert name_dict[record['message_id']][
+                        record['row']]['time'] == record['time']
+
+
+def test_array_shape_check():
+    """Reject appending arrays that do not fit an existing table."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            for length in [10, 20]:
+                trace_path = os.path.join(temp_dir, '{}.bin'.format(length))
+                with open(trace_path, 'wb') as trace_file:
+                    for i in range(3):
+                        trace_file.write(struct.pack(
+                            '<IHBB{}i'.format(length), i, 4 * length, 1, 5,
+                            *range(length)))
+                _export(h5file, trace_path, EXPORT_MODES, append=True)
+            assert h5file.root.collated.Info.nrows == 3
+            assert h5file.root.collated.Info.coldescrs['value'].shape \
+                == (10,)
+            assert h5file.root.streamed.Info_values.nrows == 6
+
+
+def test_time64_append():
+    """Extend tables with Time64 times written by an older version."""
+    records = [struct.pack('<IHBBi', i, 4, 1, 5, i) for i in range(4)] \
+        + [struct.pack('<IHBBi', 1 << 31, 4, 1, 5, 4)]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with tables.open_file(os.path.join(temp_dir, 'trace.h5'),
+                              mode='w') as h5file:
+            for group in EXPORT_MODES:
+                old_table = h5file.create_table(
+                    '/' + group, 'Info',
+                    {'time': tables.Time64Col(pos=0),
+                     'value': tables.Int32Col(pos=1)}, createparents=True)
+                old_table.attrs.message_id = 1
+                old_table.attrs.type_id = 5
+            for start, end in [(0, 4), (4, 5)]:
+                with open(trace_path, 'ab') as trace_file:
+                    trace_file.write(b''.join(records[start:end]))
+                _export(h5file, trace_path, EXPORT_MODES, append=True)
+            for group in EXPORT_MODES:
+                table = h5file.get_node('/', group).Info
+                assert table.col('time').tolist() == [0, 1, 2, 3]
+                assert table.col('value').tolist() == [0, 1, 2, 3]
@@ -1,11 +1,33 @@
 """Compare TraceReader output for samples with expected values."""
 
+import io
 import os
+import sys
+import bz2
+import gzip
+import lzma
+import zlib
+import shutil
+import time
 import struct
+import logging
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+import tables
 
 import vartools.tracereader as vttr
 import vartools.messageutils as vtmu
 import vartools.common as vtc
+import vartools.bulkreader as vtbr
+import vartools.compression as vtcz
+import vartools.hdf5 as vthdf5
+import vartools.parallel as vtpl
+import vartools.timeutils as vttu
+import vartools.traceindex as vtti
+import vartools.parser.cache as vtpc
 
 #: Location of test data.
 DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
@@ -29,7 +51,8 @@ def check_arrays(trace):
     """Check if integer arrays are correctly parsed."""
     for length in [10, 100, 1000]:
         array = vtmu.fill_pod_value(next(trace)).value
-        assert array == list(range(length))
+        assert array.dtype == 'int32'
+        assert list(array) == list(range(length))
 
 
 def check_int_sequence(trace):
@@ -89,3 +112,462 @@ def test_samples():
         with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
             trace = vttr.TraceReader(sample)
             yield function, trace
+
+
+def test_bulk_decoding():
+    """Compare bulk decoded values with values from TraceReader."""
+    for _, filename in TEST_FUNCTION_FILE:
+        with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
+            expected = [vtmu.fill_pod_value(m)
+                        for m in vttr.TraceReader(sample)]
+        with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
+            batches = list(vtbr.iter_batches(sample, batch_size=1000))
+        records = np.concatenate(
+            [b.records for b in batches] + [np.empty(0, vtbr.RECORD_DTYPE)])
+        assert len(records) == len(expected)
+        assert list(records['timestamp']) == [m.timestamp for m in expected]
+        index = 0
+        for batch in batches:
+            decoded = vtbr.decode_pod_values(batch)
+            for indices, values in decoded.values():
+                for i, value in zip(indices, values):
+                    expected_value = expected[index + i].value
+                    if isinstance(expected_value, np.ndarray):
+                        assert list(value) == list(expected_value)
+                    else:
+                        assert value == expected_value
+            index += len(batch.records)
+
+
+def test_bulk_collation():
+    """Compare bulk collation with collation of decoded messages."""
+    data = b''.join(
+        [struct.pack('<IHBBi', i, 4, 1, 5, i) for i in range(10)]
+        + [struct.pack('<IHBB2i', 10, 8, 2, 5, 1, 2),
+           struct.pack('<IHBBi', 11, 4, 2, 5, 3),
+           struct.pack('<IHBBi', 12, 4, 3, 0xf0, 4),
+           struct.pack('<IHBBhhi', 13, 6, 4, 5, 5, 6, 0)])
+    samples = [data]
+    for _, filename in TEST_FUNCTION_FILE:
+        with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
+            samples.append(sample.read())
+    decode = vtmu.DecoderRegistry().decode
+    for sample in samples:
+        expected_columns, expected_types = vtmu.collate_columns(
+            decode(m) for m in vttr.TraceReader(io.BytesIO(sample)))
+        records, _ = vtbr.scan_records(sample)
+        id_columns_dict, message_type_dict = vtbr.collate_records(
+            vtbr.RecordBatch(sample, records))
+        assert message_type_dict == expected_types
+        assert sorted(id_columns_dict) == sorted(expected_columns)
+        for message_id, columns in id_columns_dict.items():
+            expected = expected_columns[message_id]
+            assert columns.times.dtype == expected.times.dtype
+            assert columns.times.tolist() == expected.times.tolist()
+            assert columns.values.dtype == expected.values.dtype
+            assert [np.asarray(v).tolist() for v in columns.values] \
+                == [np.asarray(v).tolist() for v in expected.values]
+
+
+def test_mapped_samples():
+    """Run sample checks on memory mapped traces."""
+    for function, filename in TEST_FUNCTION_FILE:
+        with vttr.MappedTraceReader(os.path.join(DATA_PATH, filename)) \
+                as trace:
+            function(trace)
+    with open(os.path.join(DATA_PATH, 'integer_count_1000.bin'), 'rb') \
+            as sample:
+        trace = vttr.open_trace(sample)
+        assert isinstance(trace, vttr.MappedTraceReader)
+        assert isinstance(next(trace).data, memoryview)
+
+
+def test_chunked_samples():
+    """Run sample checks with chunks that split records."""
+    for function, filename in TEST_FUNCTION_FILE:
+        for chunk_size in [1, 7, 4096]:
+            with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
+                function(vttr.ChunkedTraceReader(sample,
+                                                 chunk_size=chunk_size))
+
+
+def test_trace_index():
+    """Seek inside of a trace using sidecar index."""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        shutil.copy(os.path.join(DATA_PATH, 'integer_count_1000.bin'),
+                    trace_path)
+        with open(trace_path, 'rb') as sample:
+            trace = vttr.TraceReader(sample)
+            trace.seek_to_index(500)
+            message = vtmu.fill_pod_value(next(trace))
+            assert message.value == 500
+            trace.seek_to_time(message.timestamp)
+            assert vtmu.fill_pod_value(next(trace)).value == 500
+            trace.seek_to_index(len(trace.index))
+            check_empty(trace)
+        assert os.path.exists(vtti.index_path(trace_path))
+        index = vtti.TraceIndex.load(vtti.index_path(trace_path))
+        assert index.is_valid_for(trace_path)
+        assert len(index) == 1000
+        with vttr.MappedTraceReader(trace_path, index=index) as trace:
+            trace.seek_to_index(999)
+            assert vtmu.fill_pod_value(next(trace)).value == 999
+        with open(trace_path, 'ab') as sample:
+            sample.write(b'\0' * 8)
+        assert not index.is_valid_for(trace_path)
+        assert len(vtti.load_or_build(trace_path)) == 1001
+    finally:
+        shutil.rmtree(temp_dir)
+    chunk_size = vtti.SCAN_CHUNK_SIZE
+    vtti.SCAN_CHUNK_SIZE = 100
+    try:
+        trace_path = os.path.join(DATA_PATH, 'assorted_types.bin')
+        index = vtti.TraceIndex.build(trace_path)
+    finally:
+        vtti.SCAN_CHUNK_SIZE = chunk_size
+    with open(trace_path, 'rb') as sample:
+        messages = list(vttr.TraceReader(sample))
+    assert list(index.sizes) == [m.size for m in messages]
+    assert list(index.timestamps) == [m.timestamp for m in messages]
+    assert list(index.ticks) == [m.timestamp for m in messages]
+    assert list(index.message_ids) == [m.message_id for m in messages]
+    assert index.end == os.path.getsize(trace_path)
+
+
+def _copy_sample(filename, temp_dir):
+    """Copy sample into directory, so no sidecar is left in test data."""
+    trace_path = os.path.join(temp_dir, filename)
+    shutil.copy(os.path.join(DATA_PATH, filename), trace_path)
+    return trace_path
+
+
+def test_parallel_collation():
+    """Compare parallel and serial collation of a sample."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = _copy_sample('assorted_types.bin', temp_dir)
+        with open(trace_path, 'rb') as sample:
+            expected_columns, expected_types = vtmu.collate_columns(
+                vtmu.fill_pod_value(m) for m in vttr.TraceReader(sample))
+        shards = vtpl.find_shards(trace_path, 5)
+        assert len(shards) == 5
+        assert shards[0][0] == 0
+        assert shards[-1][1] == os.path.getsize(trace_path)
+        pieces = []
+        vtpl.decode_pipeline(trace_path, [], None, 2, lambda *piece:
+                             pieces.append(piece))
+        id_columns_dict, message_type_dict = vtpl.merge_collated(pieces)
+        assert not os.path.exists(vtti.index_path(trace_path))
+    assert message_type_dict == expected_types
+    assert sorted(id_columns_dict) == sorted(expected_columns)
+    for message_id, columns in id_columns_dict.items():
+        assert list(columns.times) == list(expected_columns[message_id].times)
+        assert list(columns.values) \
+            == list(expected_columns[message_id].values)
+
+
+def test_decode_pipeline():
+    """Check that pipeline writes pieces of shards in trace order."""
+    pieces = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = _copy_sample('assorted_types.bin', temp_dir)
+        with open(trace_path, 'rb') as sample:
+            messages = [vtmu.fill_pod_value(m)
+                        for m in vttr.TraceReader(sample)]
+        vtpl.decode_pipeline(trace_path, [], None, 2,
+                             lambda *piece: pieces.append(piece),
+                             piece_size=2, queue_size=1)
+        assert len(pieces) > 2 * len(vtpl.find_shards(trace_path, 8))
+    written = [(t, message_id)
+               for id_columns_dict, _ in pieces
+               for message_id, columns in id_columns_dict.items()
+               for t in columns.times.tolist()]
+    assert sorted(written) == sorted((m.timestamp, m.message_id)
+                                     for m in messages)
+    times = [min(c.times.min() for c in id_columns_dict.values())
+             for id_columns_dict, _ in pieces]
+    assert times == sorted(times)
+
+
+def test_decode_pipeline_overlap():
+    """Check that shards are decoded while an earlier shard is written."""
+    events = []
+
+    class EventHandler(logging.Handler):
+        """Collect messages about started and finished shards."""
+
+        def emit(self, record):
+            events.append(record.getMessage())
+
+    def write(*_):
+        if not events.count('written'):
+            time.sleep(0.5)
+        events.append('written')
+
+    handler = EventHandler(logging.DEBUG)
+    logger = logging.getLogger(vtpl.__name__)
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = _copy_sample('integer_count_1000.bin', temp_dir)
+            vtpl.decode_pipeline(trace_path, [], None, 2, write,
+                                 piece_size=1, queue_size=1)
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+    assert events.index('Shard 1 started') \
+        < events.index('Shard 0 finished')
+    assert events.count('written') == 1000
+
+
+def test_decode_pipeline_error():
+    """Check that error of writer stops workers and is raised."""
+    pieces = []
+
+    def write(*piece):
+        pieces.append(piece)
+        raise RuntimeError('write failed')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = _copy_sample('assorted_types.bin', temp_dir)
+        try:
+            vtpl.decode_pipeline(trace_path, [], None, 2, write,
+                                 piece_size=1, queue_size=1)
+        except RuntimeError:
+            pass
+        else:
+            assert False, 'Error of writer was not raised'
+    assert len(pieces) == 1
+
+
+def test_wrapped_trace_index():
+    """Find times in a trace whose timestamps wrap around."""
+    period = 1 << 32
+    raw = [period - 20, period - 10, 5, 15, period - 5, 25]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trace_path = os.path.join(temp_dir, 'trace.bin')
+        with open(trace_path, 'wb') as trace_file:
+            for i, timestamp in enumerate(raw):
+                trace_file.write(struct.pack('<IHBBi', timestamp, 4, 1, 5, i))
+        vtti.TraceIndex.build(trace_path).save(vtti.index_path(trace_path))
+        index = vtti.TraceIndex.load(vtti.index_path(trace_path))
+        assert list(index.ticks) == [period - 20, period - 10, period + 5,
+                                     period + 15, period - 5, period + 25]
+        assert index.find_time(0) == 0
+        assert index.find_time(period - 15) == 1
+        assert index.find_time(period) == 2
+        assert index.find_time(period + 10) == 3
+        with vttr.MappedTraceReader(trace_path, index=index) as trace:
+            trace.seek_to_time(period + 20)
+            assert vtmu.fill_pod_value(next(trace)).value == 5
+
+
+def test_follow_growing_trace():
+    """Read trace that is written while it is being read."""
+    with open(os.path.join(DATA_PATH, 'integer_count_1000.bin'), 'rb') \
+            as sample:
+        data = sample.read()
+    with tempfile.NamedTemporaryFile() as growing:
+
+        def write_slowly():
+            for start in range(0, len(data), 1001):
+                growing.write(data[start:start + 1001])
+                growing.flush()
+
+        with open(growing.name, 'rb') as trace_file:
+            trace = vttr.open_trace(trace_file, follow=True,
+                                    poll_interval=0.001, idle_timeout=0.5)
+            writer = threading.Thread(target=write_slowly)
+            writer.start()
+            check_integer_count(trace)
+            writer.join()
+
+
+def test_compressed_samples():
+    """Run sample checks on compressed traces."""
+    for codec, module in [('gzip', gzip), ('xz', lzma), ('bz2', bz2)]:
+        for function, filename in TEST_FUNCTION_FILE:
+            with open(os.path.join(DATA_PATH, filename), 'rb') as sample:
+                compressed = io.BytesIO(module.compress(sample.read()))
+            assert vtcz.detect_codec(compressed) == codec
+            function(vttr.open_trace(compressed))
+            compressed.seek(0)
+            try:
+                vttr.open_trace(compressed, follow=True)
+            except ValueError:
+                pass
+            else:
+                assert False, 'Compressed trace was followed'
+            function(vttr.TraceReader(io.BufferedReader(compressed)))
+
+
+def test_corrupted_compressed_trace():
+    """Fail reading instead of hanging when decompression fails."""
+    data = b''.join(struct.pack('<IHBBi', i, 4, 1, 5, i)
+                    for i in range(20000))
+    for module in [gzip, lzma, bz2]:
+        compressed = bytearray(module.compress(data))
+        middle = len(compressed) // 2
+        compressed[middle:middle + 16] = bytes(
+            b ^ 0xff for b in compressed[middle:middle + 16])
+        trace = vttr.open_trace(io.BytesIO(bytes(compressed)))
+        try:
+            for _ in trace:
+                pass
+        except (IOError, EOFError, lzma.LZMAError, zlib.error):
+            pass
+        else:
+            assert False, 'Corrupted trace was read'
+
+
+def test_header_filter():
+    """Check that all readers skip rejected records."""
+    trace_path = os.path.join(DATA_PATH, 'assorted_types.bin')
+    with open(trace_path, 'rb') as sample:
+        data = sample.read()
+    messages = list(vttr.TraceReader(io.BytesIO(data)))
+    header_filter = vtc.create_header_filter(
+        type_ids=[5, 0xf], start=messages[2].timestamp)
+    expected = [m for m in messages[2:] if m.type_id in (5, 0xf)]
+    assert expected
+    readers = [vttr.TraceReader(io.BytesIO(data),
+                                header_filter=header_filter),
+               vttr.ChunkedTraceReader(io.BytesIO(data), chunk_size=5,
+                                       header_filter=header_filter),
+               vttr.MappedTraceReader(trace_path,
+                                      header_filter=header_filter)]
+    for reader in readers:
+        assert [(m.timestamp, bytes(m.data)) for m in reader] \
+            == [(m.timestamp, m.data) for m in expected]
+    records = np.concatenate([b.records for b in vtbr.iter_batches(
+        io.BytesIO(data), header_filter=header_filter)])
+    assert list(records['timestamp']) == [m.timestamp for m in expected]
+    assert vtc.create_header_filter() is None
+
+
+def test_timestamp_unwrapping():
+    """Unwrap timestamps split between batches and calibrate them."""
+    period = 1 << 32
+    raw = [period - 20, period - 10, 5, 3, 15, period - 5, 0, 10]
+    expected = [period - 20, period - 10, period + 5, period + 3,
+                period + 15, period - 5, period, period + 10]
+    unwrapper = vttu.TimestampUnwrapper()
+    ticks = list(unwrapper.unwrap(raw[:3])) + list(unwrapper.unwrap(raw[3:]))
+    assert ticks == expected
+    late = [period - 10, 5, period - 5, 10]
+    assert list(vttu.TimestampUnwrapper().unwrap(late)) \
+        == [period - 10, period + 5, period - 5, period + 10]
+    converted = vttu.convert_times(raw, vttu.TimestampUnwrapper(),
+                                   vttu.Calibration(1e-3, 100.0))
+    assert converted.tolist() == [t * 1e-3 + 100.0 for t in expected]
+    messages = [vtc.TraceMessage(timestamp=t, size=4, message_id=i % 2,
+                                 type_id=5, data=b'',
+                                 value=None if i == 1 else i)
+                for i, t in enumerate(raw)]
+    id_columns_dict, _ = vtmu.collate_columns(
+        messages, convert_times=vttu.TimestampUnwrapper().unwrap)
+    assert id_columns_dict[0].times.tolist() == expected[0::2]
+    assert id_columns_dict[1].times.tolist() == expected[3::2]
+    assert id_columns_dict[1].values.tolist() == [3, 5, 7]
+
+
+def test_columnar_collation():
+    """Check that columns keep native types and zero values."""
+    with open(os.path.join(DATA_PATH, 'assorted_types.bin'), 'rb') as sample:
+        messages = [vtmu.fill_pod_value(m) for m in vttr.TraceReader(sample)]
+    id_values_dict, message_type_dict = vtmu.collate_values(messages)
+    id_columns_dict, columns_type_dict = vtmu.collate_columns(messages)
+    assert message_type_dict == columns_type_dict
+    for message_id, columns in id_columns_dict.items():
+        assert columns.times.dtype == 'uint64'
+        format_char = vtc.TYPE_ID_FORMAT_DICT[message_type_dict[message_id]]
+        assert columns.values.dtype == format_char
+        assert list(zip(columns.times, columns.values)) \
+            == id_values_dict[message_id]
+    assert sum(len(c.values) for c in id_columns_dict.values()) \
+        == len(messages)
+    with open(os.path.join(DATA_PATH, 'arrays_10_100_1000.bin'), 'rb') \
+            as sample:
+        id_columns_dict, _ = vtmu.collate_columns(
+            vtmu.fill_pod_value(m) for m in vttr.TraceReader(sample))
+    for length, columns in zip([10, 100, 1000],
+                               sorted(id_columns_dict.values(), key=len)):
+        assert columns.values.shape == (1, length)
+
+
+def test_column_buffer():
+    """Check that buffer of scalars accepts rows that do not fit it."""
+    column = vtmu.ColumnBuffer(np.uint8)
+    for value in range(2000):
+        column.append(value % 256)
+    assert column.array.dtype == np.uint8
+    assert column.array.tolist() == [v % 256 for v in range(2000)]
+    column.append(np.arange(3))
+    assert len(column) == 2001
+    assert column.array.dtype == object
+    assert list(column.array[-1]) == [0, 1, 2]
+    column.clear()
+    assert len(column) == 0
+    column.append(7)
+    assert column.array.dtype == np.uint8
+    assert column.array.tolist() == [7]
+
+
+def test_array_export():
+    """Check fixed and variable length array tables."""
+    with open(os.path.join(DATA_PATH, 'arrays_10_100_1000.bin'), 'rb') \
+            as sample:
+        messages = [vtmu.fill_pod_value(m) for m in vttr.TraceReader(sample)]
+    id_columns_dict, message_type_dict = vtmu.collate_columns(messages)
+    message_desc_dict = {i: vtc.Description('Array{}'.format(i), '')
+                         for i in message_type_dict}
+    ragged_dict = {0: [(m.timestamp, m.value) for m in messages]}
+    with tempfile.NamedTemporaryFile(suffix='.h5') as output:
+        with tables.open_file(output.name, mode='w') as h5file:
+            vthdf5.export(h5file, '/', id_columns_dict, message_type_dict,
+                          message_desc_dict, {})
+            for message_id, columns in id_columns_dict.items():
+                table = h5file.get_node('/Array{}'.format(message_id))
+                assert table.coldescrs['value'].shape \
+                    == columns.values.shape[1:]
+                assert np.array_equal(table.col('value'), columns.values)
+            group = h5file.create_group('/', 'ragged')
+            vthdf5.export(h5file, group, ragged_dict,
+                          {0: message_type_dict[messages[0].message_id]},
+                          message_desc_dict, {})
+            assert group.Array0.colnames == ['time']
+            assert [list(v) for v in group.Array0_values.read()] \
+                == [list(m.value) for m in messages]
+            assert list(group.Array0.col('time')) \
+                == [m.timestamp for m in messages]
+
+
+def test_startup():
+    """Text conversion must not import PyTables, startup time is printed.
+
+    The time is reported rather than checked, limits of wall-clock time
+    fail at random on loaded machines.
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    header = os.path.join(package_dir, 'vartools', 'parser', 'test', 'data',
+                          'trace_codes.h')
+    command = [sys.executable, '-c',
+               'import sys, time; '
+               'start = time.perf_counter(); '
+               'import vartools.traceconverter as vttc; '
+               'vttc._create_argument_parser(); '
+               'vttc._parse_cpp_headers([{!r}], "<i"); '
+               'print(time.perf_counter() - start); '
+               'assert "tables" not in sys.modules'.format(header)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        environment = dict(os.environ)
+        environment[vtpc.CACHE_DIR_VARIABLE] = cache_dir
+        times = [float(subprocess.check_output(command, cwd=package_dir,
+                                               env=environment))
+                 for _ in range(2)]
+    print('Text conversion startup: {0:.3f} s with empty cache, {1:.3f} s '
+          'with filled cache'.format(*times))
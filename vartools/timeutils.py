@@ -0,0 +1,106 @@
+"""Conversion of raw trace timestamps into absolute time.
+
+Timestamps are stored as 32 bit tick counters, so long captures wrap
+around. :class:`TimestampUnwrapper` turns them into monotonically
+increasing 64 bit tick counts and :class:`Calibration` maps ticks onto
+seconds. Both work on whole NumPy arrays, :func:`convert_times` applies
+them to a column of raw timestamps of all records in trace order.
+"""
+
+# pylint: disable=E1101,W0212
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+import vartools.common as vtc
+
+#: Number of bits in a serialized timestamp.
+TIMESTAMP_BITS = 8 * struct.calcsize(vtc.HEADER_STRUCTURE[0][1])
+
+
+class Calibration(namedtuple('Calibration', 'tick_period epoch')):
+    """Linear clock calibration: ``time = ticks * tick_period + epoch``.
+
+    :param float tick_period: duration of a tick in seconds
+    :param float epoch: time of the zero tick in seconds
+    """
+
+    __slots__ = ()
+
+    def apply(self, ticks):
+        """Convert array of ticks into array of seconds."""
+        return np.asarray(ticks, dtype=np.float64) * self.tick_period \
+            + self.epoch
+
+
+class TimestampUnwrapper:
+    """Unwrap batches of wrapping timestamps into 64 bit tick counts.
+
+    A drop of a timestamp by more than a half of counter range is
+    treated as a wraparound, smaller drops are considered to be out of
+    order records. A jump forward by more than a half of the range is a
+    late record written before the last wraparound. State is kept
+    between batches, so a trace can be processed in consecutive pieces.
+    """
+
+    def __init__(self, bits=TIMESTAMP_BITS, offset=0, last=None):
+        """Create unwrapper for counters with given number of bits.
+
+        :param int bits: number of bits of the counter
+        :param int offset: ticks added to the next timestamp, see
+            :attr:`offset`
+        :param int last: raw timestamp before the next one, see
+            :attr:`last`
+        """
+        self._range = 1 << bits
+        self._offset = offset
+        self._last = last
+
+    @property
+    def offset(self):
+        """Ticks of all wraparounds so far, saved to resume unwrapping."""
+        return self._offset
+
+    @property
+    def last(self):
+        """Last raw timestamp or None, saved to resume unwrapping."""
+        return self._last
+
+    def unwrap(self, timestamps):
+        """Return unwrapped copy of a timestamp array.
+
+        :param timestamps: raw timestamps in trace order
+        :rtype: numpy.ndarray of uint64
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(timestamps):
+            return timestamps.astype(np.uint64)
+        previous = np.empty_like(timestamps)
+        previous[0] = timestamps[0] if self._last is None else self._last
+        previous[1:] = timestamps[:-1]
+        steps = timestamps - previous
+        half_range = self._range // 2
+        wraps = np.cumsum((steps < -half_range).astype(np.int64)
+                          - (steps > half_range))
+        ticks = timestamps + (self._offset + wraps * self._range)
+        self._offset += int(wraps[-1]) * self._range
+        self._last = int(timestamps[-1])
+        return ticks.astype(np.uint64)
+
+
+def convert_times(timestamps, unwrapper=None, calibration=None):
+    """Unwrap and calibrate raw timestamps in one vectorized pass.
+
+    :param timestamps: raw timestamps of all records in trace order
+    :param unwrapper: unwrapper, timestamps are not unwrapped if None
+    :type unwrapper: :class:`TimestampUnwrapper`
+    :param calibration: calibration, ticks are kept if None
+    :type calibration: :class:`Calibration`
+    :return: uint64 ticks or float64 seconds if calibration is set
+    :rtype: numpy.ndarray
+    """
+    times = (unwrapper.unwrap(timestamps) if unwrapper
+             else np.asarray(timestamps, dtype=np.uint64))
+    return calibration.apply(times) if calibration else times
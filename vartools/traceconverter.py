@@ -1,22 +1,27 @@
 import argparse
 import logging
 
-from vartools.parser.enumparser import EnumParser
-from vartools.parser.utils import clean_enums, MESSAGE_CATEGORY_ID, \
-    TYPE_CATEGORY_ID, EVENT_CATEGORY_ID
-from vartools.tracereader import TraceReader
-from vartools.messageutils import message_to_text, message_to_clojure
+import vartools.common as vtc
+import vartools.parser.utils as vtpu
+from vartools.tracereader import open_trace, is_compressed
+from vartools.messageutils import message_to_text
 
 
 _logger = logging.getLogger(__name__)
 _VERBOSITY_LOGLEVEL_DICT = {0: logging.ERROR, 1: logging.WARN,
                             2: logging.INFO, 3: logging.DEBUG}
+_DEFAULT_EVENT_FORMAT = '<i'
+
+
+def _integer(text):
+    """Parse decimal or prefixed (0x, 0o, 0b) integer argument."""
+    return int(text, 0)
 
 
 def _create_argument_parser():
     argument_parser = argparse.ArgumentParser()
     # input and output parameters
-    argument_parser.add_argument('-i', '--input', type=argparse.FileType('r'),
+    argument_parser.add_argument('-i', '--input', type=argparse.FileType('rb'),
                                  default='-',
                                  help=('input file name, if not specified '
                                        'use stdin'))
@@ -24,11 +29,63 @@ def _create_argument_parser():
                                  default='-',
                                  help=('output file name, if not specified '
                                        'use stdout'))
+    argument_parser.add_argument('--hdf5',
+                                 help=('export values into this hdf5 file '
+                                       'instead of text output'))
+    argument_parser.add_argument('--group', default='trace',
+                                 help=('slash separated path of the trace '
+                                       'group inside hdf5 file'))
+    argument_parser.add_argument('-a', '--append', action='store_true',
+                                 help=('append new records to an existing '
+                                       'trace group'))
+    argument_parser.add_argument('--buffer-size', type=int,
+                                 help=('byte budget of rows buffered before '
+                                       'they are written into hdf5 file'))
+    argument_parser.add_argument('--complib',
+                                 help=('compression library of hdf5 '
+                                       'tables, e.g. zlib, blosc, lzo or '
+                                       'bzip2'))
+    argument_parser.add_argument('--complevel', type=int,
+                                 choices=range(10),
+                                 help='compression level of hdf5 tables')
+    argument_parser.add_argument('--no-shuffle', dest='shuffle',
+                                 action='store_false',
+                                 help='disable shuffle filter')
+    argument_parser.add_argument('--chunk-size', type=int,
+                                 help='number of rows in hdf5 table chunk')
+    argument_parser.add_argument('--index', action='store_true',
+                                 help=('index time columns for fast time '
+                                       'range queries'))
+    argument_parser.add_argument('--all-messages', action='store_true',
+                                 help=('add time ordered table of all '
+                                       'messages'))
     argument_parser.add_argument('-c', '--cpp-header', nargs='+',
                                  help=('c++ header file names that describe '
                                        'trace ids'))
-    argument_parser.add_argument('--clojure', action='count',
-                                 help=('convert trace to clojure'))
+    argument_parser.add_argument('--header-workers', type=int,
+                                 help='parse headers in that many processes')
+    argument_parser.add_argument('-e', '--event-format',
+                                 default=_DEFAULT_EVENT_FORMAT,
+                                 help=('struct format of event codes, '
+                                       'default: {}'.format(
+                                           _DEFAULT_EVENT_FORMAT)))
+    argument_parser.add_argument('-w', '--workers', type=int,
+                                 help=('decode trace in that many processes '
+                                       'when exporting into hdf5 file'))
+    argument_parser.add_argument('-f', '--follow', action='store_true',
+                                 help=('wait for new records at the end of '
+                                       'input, like tail -f; input must '
+                                       'not be compressed'))
+    # header filters
+    argument_parser.add_argument('--message-id', type=_integer, nargs='+',
+                                 help='output only messages with these ids')
+    argument_parser.add_argument('--type-id', type=_integer, nargs='+',
+                                 help='output only messages with these types')
+    argument_parser.add_argument('--start', type=_integer,
+                                 help='skip messages before this timestamp')
+    argument_parser.add_argument('--end', type=_integer,
+                                 help=('skip messages starting from this '
+                                       'timestamp'))
     # verbosity level
     argument_parser.add_argument(
         "-v", "--verbosity", action="count", default=0,
@@ -36,24 +93,11 @@ def _create_argument_parser():
     return argument_parser
 
 
-def _parse_cpp_headers(headers):
-    enum_parser = EnumParser()
-    message_ids = {}
-    type_ids = {}
-    event_ids = []
+def _parse_cpp_headers(headers, event_format, workers=None):
     for header in headers:
         _logger.debug('Parsing cpp header: {}'.format(header))
-        with open(header, 'r') as header_file:
-            code = header_file.read()
-            extracted_enums = clean_enums(enum_parser.parse(code))
-            for enum in extracted_enums:
-                if enum.category == MESSAGE_CATEGORY_ID:
-                    message_ids.update(enum.members)
-                if enum.category == TYPE_CATEGORY_ID:
-                    type_ids.update(enum.members)
-                if enum.category == EVENT_CATEGORY_ID:
-                    event_ids.append(enum)
-    return message_ids, type_ids, event_ids
+    return vtpu.parse_headers(headers, workers=workers,
+                              event_format=event_format)
 
 
 def convert_vartrace():
@@ -61,12 +105,39 @@ def convert_vartrace():
     arguments = argument_parser.parse_args()
     logging.basicConfig(
         level=_VERBOSITY_LOGLEVEL_DICT.get(arguments.verbosity, 3))
-    if arguments.clojure:
-        converter = message_to_clojure
-    else:
-        converter = message_to_text
-    message_ids, type_ids, event_ids = _parse_cpp_headers(arguments.cpp_header)
-    for m in TraceReader(arguments.input):
-        arguments.output.write(converter(m, message_ids,
-                                         type_ids, event_ids))
+    if arguments.follow and is_compressed(arguments.input):
+        argument_parser.error('compressed traces can not be followed')
+    header_filter = vtc.create_header_filter(
+        arguments.message_id, arguments.type_id, arguments.start,
+        arguments.end)
+    headers = arguments.cpp_header if arguments.cpp_header else []
+    if arguments.hdf5:
+        # PyTables takes most of the startup time, text output needs none
+        import tables
+        import vartools.convert as vtcv
+        with tables.open_file(arguments.hdf5, mode='a') as h5file:
+            vtcv.to_hdf5(h5file, arguments.group.strip('/').split('/'),
+                         arguments.input, headers=headers,
+                         event_format=arguments.event_format,
+                         header_filter=header_filter, streaming=True,
+                         workers=arguments.workers,
+                         buffer_size=arguments.buffer_size,
+                         follow=arguments.follow,
+                         complib=arguments.complib,
+                         complevel=arguments.complevel,
+                         shuffle=arguments.shuffle,
+                         chunk_size=arguments.chunk_size,
+                         index=arguments.index,
+                         append=arguments.append,
+                         all_messages=arguments.all_messages,
+                         header_workers=arguments.header_workers)
+        return
+    message_ids, type_ids = _parse_cpp_headers(headers,
+                                               arguments.event_format,
+                                               arguments.header_workers)
+    trace = open_trace(arguments.input, follow=arguments.follow,
+                       header_filter=header_filter,
+                       idle_callback=arguments.output.flush)
+    for m in trace:
+        arguments.output.write(message_to_text(m, message_ids, type_ids))
         arguments.output.write('\n')
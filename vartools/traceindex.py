@@ -0,0 +1,220 @@
+"""Persistent offset index for random access into trace files.
+
+Traces have no sync markers, so the only way to find a record is to
+walk all headers from the beginning of the file. The index stores
+offsets, raw and unwrapped timestamps, payload sizes, message and type
+ids of all records in array backed columns and is saved next to the
+trace in a sidecar file (see :const:`INDEX_SUFFIX`). The sidecar is
+validated against size and modification time of the trace.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import bisect
+import logging
+from array import array
+
+import numpy as np
+
+import vartools.common as vtc
+import vartools.bulkreader as vtbr
+import vartools.timeutils as vttu
+
+#: Suffix appended to trace file name to get index file name.
+INDEX_SUFFIX = '.vtidx'
+
+_MAGIC = b'VTIDX'
+_VERSION = 4
+#: Magic, version, trace size, trace mtime, end of the last complete
+#: record and number of records.
+_INDEX_HEADER = struct.Struct('<5sBQdQQ')
+#: Column names and ``array`` type codes.
+_COLUMNS = [('offsets', 'Q'), ('timestamps', 'I'), ('sizes', 'H'),
+            ('message_ids', 'B'), ('type_ids', 'B'), ('ticks', 'Q')]
+#: Map index columns onto fields of :const:`~vartools.bulkreader.RECORD_DTYPE`.
+_COLUMN_FIELDS = [('offsets', 'offset'), ('timestamps', 'timestamp'),
+                  ('sizes', 'size'), ('message_ids', 'message_id'),
+                  ('type_ids', 'type_id')]
+#: Number of bytes of trace described by one batch of records while
+#: index is built.
+SCAN_CHUNK_SIZE = 1 << 20
+
+_logger = logging.getLogger(__name__)
+
+
+def index_path(trace_path):
+    """Return path of the sidecar index file for a trace."""
+    return trace_path + INDEX_SUFFIX
+
+
+class TraceIndex:
+    """Offsets, timestamps and ids of all records of a trace."""
+
+    def __init__(self, trace_size=0, trace_mtime=0.0, end=0):
+        #: Size of indexed trace in bytes.
+        self.trace_size = trace_size
+        #: Modification time of indexed trace.
+        self.trace_mtime = trace_mtime
+        #: Offset after the last complete record, smaller than trace
+        #: size if trace ends with an incomplete record.
+        self.end = end
+        #: Offsets of record headers.
+        self.offsets = array('Q')
+        #: Record timestamps.
+        self.timestamps = array('I')
+        #: Record payload sizes.
+        self.sizes = array('H')
+        #: Record message ids.
+        self.message_ids = array('B')
+        #: Record type ids.
+        self.type_ids = array('B')
+        #: Record timestamps unwrapped with
+        #: :class:`~vartools.timeutils.TimestampUnwrapper`.
+        self.ticks = array('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, trace_path, endianess=None):
+        """Walk all record headers of a trace file and index them.
+
+        :param str trace_path: path to trace file
+        :param str endianess: endianess string (see :mod:`struct`).
+        """
+        stat_result = os.stat(trace_path)
+        index = cls(stat_result.st_size, stat_result.st_mtime)
+        if not stat_result.st_size:
+            return index
+        with open(trace_path, 'rb') as trace_file:
+            buffer = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                index._scan(buffer, endianess)
+            finally:
+                buffer.close()
+        return index
+
+    def _scan(self, buffer, endianess):
+        """Append all complete records of a buffer to the index.
+
+        Records are found with :func:`vartools.bulkreader.scan_records`
+        in chunks of :const:`SCAN_CHUNK_SIZE` bytes, so memory used by
+        record descriptions does not depend on trace size.
+        """
+        unwrapper = vttu.TimestampUnwrapper()
+        position = 0
+        end = len(buffer)
+        while position < end:
+            chunk_end = min(position + SCAN_CHUNK_SIZE, end)
+            records, next_position = vtbr.scan_records(
+                buffer, endianess, position, chunk_end,
+                final=chunk_end == end)
+            records['offset'] -= vtc.HEADER_SIZE
+            for name, field in _COLUMN_FIELDS:
+                column = getattr(self, name)
+                column.frombytes(records[field].astype(
+                    np.dtype(column.typecode)).tobytes())
+            self.ticks.frombytes(
+                unwrapper.unwrap(records['timestamp']).tobytes())
+            if next_position == position:
+                break
+            position = next_position
+        self.end = position
+        if position < end:
+            _logger.error('Incomplete record at offset {}'.format(position))
+
+    def is_valid_for(self, trace_path):
+        """Check if index corresponds to the current state of trace."""
+        stat_result = os.stat(trace_path)
+        return (stat_result.st_size == self.trace_size
+                and stat_result.st_mtime == self.trace_mtime)
+
+    def save(self, path):
+        """Write index into a file.
+
+        :param str path: path of the index file
+        """
+        with open(path, 'wb') as index_file:
+            index_file.write(_INDEX_HEADER.pack(
+                _MAGIC, _VERSION, self.trace_size, self.trace_mtime,
+                self.end, len(self)))
+            for name, _ in _COLUMNS:
+                column = getattr(self, name)
+                if sys.byteorder != 'little':
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                index_file.write(column.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Read index from a file.
+
+        :param str path: path of the index file
+        :return: index or None if file has unknown format
+        """
+        with open(path, 'rb') as index_file:
+            header = index_file.read(_INDEX_HEADER.size)
+            if len(header) < _INDEX_HEADER.size:
+                return None
+            magic, version, trace_size, trace_mtime, end, count = \
+                _INDEX_HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                return None
+            index = cls(trace_size, trace_mtime, end)
+            for name, typecode in _COLUMNS:
+                column = array(typecode)
+                data = index_file.read(count * column.itemsize)
+                if len(data) != count * column.itemsize:
+                    return None
+                column.frombytes(data)
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                setattr(index, name, column)
+        return index
+
+    def find_time(self, ticks):
+        """Return number of the first record with time not before given.
+
+        Unwrapped timestamps of the trace are assumed to be non
+        decreasing, late records may be found out of order.
+
+        :param int ticks: unwrapped timestamp, same as raw timestamp
+            before the first wraparound of the counter
+        """
+        return bisect.bisect_left(self.ticks, ticks)
+
+    def offset(self, record_number):
+        """Return offset of a record.
+
+        The number after the last record gives offset after the last
+        complete record, reading of a growing trace is resumed there.
+        """
+        if record_number == len(self):
+            return self.end
+        return self.offsets[record_number]
+
+
+def load_or_build(trace_path, endianess=None, save=True):
+    """Load valid sidecar index or build a new one.
+
+    :param str trace_path: path to trace file
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param bool save: write newly built index next to the trace
+    :rtype: :class:`TraceIndex`
+    """
+    path = index_path(trace_path)
+    if os.path.exists(path):
+        index = TraceIndex.load(path)
+        if index is not None and index.is_valid_for(trace_path):
+            return index
+        _logger.info('Rebuilding stale index {}'.format(path))
+    index = TraceIndex.build(trace_path, endianess)
+    if save:
+        try:
+            index.save(path)
+        except (IOError, OSError) as error:
+            _logger.warning('Failed to save index {0}: {1}'.format(
+                path, error))
+    return index
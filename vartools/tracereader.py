@@ -1,24 +1,70 @@
+import io
 import logging
+import mmap
+import os
+import stat
 import struct
+import time
 
 from future.utils import implements_iterator
 
 import vartools.common as vtc
+import vartools.compression as vtcz
+import vartools.traceindex as vtti
+
+#: Number of bytes read at once by :class:`ChunkedTraceReader`.
+DEFAULT_CHUNK_SIZE = 1 << 16
+#: Seconds between checks for new data in follow mode.
+DEFAULT_POLL_INTERVAL = 0.1
 
 
 @implements_iterator
 class TraceReader:
     """Iterate over trace messages from given stream."""
 
-    def __init__(self, stream, endianess=None):
+    def __init__(self, stream, endianess=None, index=None, follow=False,
+                 poll_interval=None, idle_timeout=None, idle_callback=None,
+                 header_filter=None):
         """Create object that spits out trace messages.
 
+        Compressed streams are decompressed transparently (see
+        :mod:`vartools.compression`). In follow mode the end of stream
+        is not the end of trace: reader polls the stream until a record
+        is complete, so growing trace files can be processed while they
+        are written. Compressed traces can not be followed.
+
         :param io.RawIOBase stream: data source,
         :param str endianess: endianess string (see :mod:`struct`).
+        :param index: record index, loaded or built on first seek if
+            not specified
+        :type index: :class:`~vartools.traceindex.TraceIndex`
+        :param bool follow: wait for new data at the end of stream
+        :param float poll_interval: seconds between checks for new data
+        :param float idle_timeout: stop following if no data arrives
+            for that many seconds, wait forever if not specified
+        :param idle_callback: function called without arguments before
+            reader starts waiting for new data, e.g. to flush output
+        :param header_filter: records rejected by filter are skipped
+            without reading their data
+        :type header_filter: :class:`~vartools.common.HeaderFilter`
+        :raises ValueError: if compressed stream is followed
         """
         self._logger = logging.getLogger('TraceReader')
-        self._stream = stream
+        if follow and is_compressed(stream):
+            raise ValueError('Compressed trace can not be followed')
+        self._stream = stream if follow else vtcz.open_decompressed(stream)
+        self._follow = follow
+        self._poll_interval = (poll_interval if poll_interval
+                               else DEFAULT_POLL_INTERVAL)
+        self._idle_timeout = idle_timeout
+        self._idle_callback = idle_callback
+        self._padding_size = 0
+        self._offset = (self._stream.tell() if is_regular_file(self._stream)
+                        else 0)
+        self._header_filter = header_filter
         endianess = endianess if endianess else vtc.DEFAULT_ENDIANESS
+        self._endianess = endianess
+        self._index = index
         self._header_structure = [
             (name, endianess + field_format, struct.calcsize(field_format))
             for name, field_format in vtc.HEADER_STRUCTURE]
@@ -27,6 +73,75 @@ class TraceReader:
     def __iter__(self):
         return self
 
+    @property
+    def index(self):
+        """Record index of the trace, see :mod:`vartools.traceindex`."""
+        if self._index is None:
+            self._index = vtti.load_or_build(self._stream.name,
+                                             self._endianess)
+        return self._index
+
+    @property
+    def offset(self):
+        """Offset of the record after the last returned one.
+
+        Offset is counted from the beginning of the stream if it is a
+        regular file and from the position where reading started
+        otherwise.
+        """
+        return self._offset
+
+    def seek_to_index(self, record_number):
+        """Continue reading from the record with given number."""
+        self._offset = self.index.offset(record_number)
+        self._stream.seek(self._offset)
+        self._padding_size = 0
+
+    def seek_to_time(self, ticks):
+        """Continue reading from the first record not before given time.
+
+        :param int ticks: unwrapped timestamp, see
+            :meth:`~vartools.traceindex.TraceIndex.find_time`
+        """
+        self.seek_to_index(self.index.find_time(ticks))
+
+    def _read(self, size):
+        """Read from stream, in follow mode wait until size bytes arrive.
+
+        :return: data, shorter than size only at the end of trace.
+        """
+        data = self._stream.read(size)
+        if not self._follow:
+            return data
+        idle_time = 0.0
+        while len(data) < size:
+            if idle_time == 0.0 and self._idle_callback:
+                self._idle_callback()
+            if self._idle_timeout is not None \
+                    and idle_time >= self._idle_timeout:
+                break
+            time.sleep(self._poll_interval)
+            idle_time += self._poll_interval
+            chunk = self._stream.read(size - len(data))
+            if chunk:
+                data += chunk
+                idle_time = 0.0
+        return data
+
+    def _skip(self, size):
+        """Skip data, seekable streams are not read."""
+        if not self._follow and hasattr(self._stream, 'seekable') \
+           and self._stream.seekable():
+            self._stream.seek(size, io.SEEK_CUR)
+        else:
+            self._read(size)
+
+    def _is_accepted(self, log_entry):
+        """Check header of a log entry against the filter."""
+        return vtc.is_header_accepted(
+            self._header_filter, log_entry['timestamp'],
+            log_entry['message_id'], log_entry['type_id'])
+
     def _read_header(self):
         """Parse header and store in a dictionary.
 
@@ -34,9 +149,9 @@ class TraceReader:
         """
         log_entry = {}
         for field_name, field_format, field_size in self._header_structure:
-            field_data = self._stream.read(field_size)
-            if not field_data:
-                if field_name != self._header_structure[0][0]:
+            field_data = self._read(field_size)
+            if len(field_data) < field_size:
+                if field_data or field_name != self._header_structure[0][0]:
                     self._logger.error(
                         'Reading stopped on field: {}'.format(field_name))
                 raise StopIteration
@@ -49,7 +164,7 @@ class TraceReader:
         :param dict log_entry: dictionary with filled header fields.
         :return: dictionary with filled header, data and empty value fields.
         """
-        log_entry['data'] = self._stream.read(log_entry['size'])
+        log_entry['data'] = self._read(log_entry['size'])
         if len(log_entry['data']) < log_entry['size']:
             self._logger.error('Data read failed: got {0} expected {1}'.format(
                 len(log_entry['data']), log_entry['size']))
@@ -60,11 +175,274 @@ class TraceReader:
     def __next__(self):
         """Return next top level log entry.
 
-        Iteration stops if no data can be read.
+        Iteration stops if no data can be read. Padding after data is
+        skipped on the next call, so in follow mode a record is
+        returned as soon as its data is available.
         """
+        if self._padding_size:
+            self._read(self._padding_size)
         log_entry = self._read_header()
+        while not self._is_accepted(log_entry):
+            self._skip(log_entry['size'] + vtc.padding_size(log_entry['size']))
+            self._offset += vtc.HEADER_SIZE + log_entry['size'] \
+                + vtc.padding_size(log_entry['size'])
+            log_entry = self._read_header()
         log_entry = self._read_data(log_entry)
-        if log_entry['size'] % vtc.ALIGNMENT_SIZE != 0:
-            remainder = log_entry['size'] % vtc.ALIGNMENT_SIZE
-            self._stream.read(vtc.ALIGNMENT_SIZE - remainder)
+        self._padding_size = vtc.padding_size(log_entry['size'])
+        self._offset += vtc.HEADER_SIZE + log_entry['size'] \
+            + self._padding_size
         return vtc.TraceMessage(**log_entry)
+
+
+@implements_iterator
+class MappedTraceReader:
+    """Iterate over trace messages of a memory mapped file.
+
+    Data of produced messages are :class:`memoryview` slices of the
+    mapped file, so no payload is copied while reading.
+    """
+
+    def __init__(self, trace_file, endianess=None, index=None, end=None,
+                 header_filter=None):
+        """Map trace file into memory.
+
+        :param trace_file: path or file object opened in binary mode
+        :param str endianess: endianess string (see :mod:`struct`).
+        :param index: record index, loaded or built on first seek if
+            not specified
+        :type index: :class:`~vartools.traceindex.TraceIndex`
+        :param int end: stop reading at this offset instead of the end
+            of file
+        :param header_filter: records rejected by filter are skipped
+        :type header_filter: :class:`~vartools.common.HeaderFilter`
+        """
+        self._logger = logging.getLogger('MappedTraceReader')
+        self._own_file = not hasattr(trace_file, 'fileno')
+        self._file = open(trace_file, 'rb') if self._own_file else trace_file
+        file_size = os.fstat(self._file.fileno()).st_size
+        self._map = (mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                     if file_size else None)
+        #: Read only view of the whole trace.
+        self.buffer = memoryview(self._map if self._map else b'')
+        self._end = len(self.buffer) if end is None else end
+        self._header_filter = header_filter
+        endianess = endianess if endianess else vtc.DEFAULT_ENDIANESS
+        self._endianess = endianess
+        self._index = index
+        self._header_struct = struct.Struct(endianess + vtc.HEADER_FORMAT)
+        self._position = 0 if self._own_file else self._file.tell()
+        self._offset = self._position
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def index(self):
+        """Record index of the trace, see :mod:`vartools.traceindex`."""
+        if self._index is None:
+            self._index = vtti.load_or_build(self._file.name, self._endianess)
+        return self._index
+
+    @property
+    def offset(self):
+        """Offset of the record after the last complete one."""
+        return self._offset
+
+    def seek(self, offset):
+        """Continue reading from the record that starts at offset."""
+        self._position = offset
+        self._offset = offset
+
+    def seek_to_index(self, record_number):
+        """Continue reading from the record with given number."""
+        self.seek(self.index.offset(record_number))
+
+    def seek_to_time(self, ticks):
+        """Continue reading from the first record not before given time.
+
+        :param int ticks: unwrapped timestamp, see
+            :meth:`~vartools.traceindex.TraceIndex.find_time`
+        """
+        self.seek_to_index(self.index.find_time(ticks))
+
+    def close(self):
+        """Unmap trace file.
+
+        If some messages still reference the mapped data the mapping
+        is released when the last reference is gone.
+        """
+        self.buffer.release()
+        if self._map:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+        if self._own_file:
+            self._file.close()
+
+    def __next__(self):
+        """Return next log entry with data referencing the mapped file."""
+        end = self._end
+        while True:
+            if self._position + vtc.HEADER_SIZE > end:
+                if self._position < end:
+                    self._logger.error('Reading stopped inside of header')
+                raise StopIteration
+            timestamp, size, message_id, type_id = \
+                self._header_struct.unpack_from(self.buffer, self._position)
+            data_start = self._position + vtc.HEADER_SIZE
+            data_end = data_start + size
+            if data_end > end:
+                self._logger.error(
+                    'Data read failed: got {0} expected {1}'.format(
+                        end - data_start, size))
+                self._position = end
+                raise StopIteration
+            self._position = data_end + vtc.padding_size(size)
+            self._offset = min(self._position, end)
+            if vtc.is_header_accepted(self._header_filter, timestamp,
+                                      message_id, type_id):
+                break
+        return vtc.TraceMessage(timestamp=timestamp, size=size,
+                                message_id=message_id, type_id=type_id,
+                                data=self.buffer[data_start:data_end],
+                                value=None)
+
+
+@implements_iterator
+class ChunkedTraceReader:
+    """Iterate over trace messages from a non seekable stream.
+
+    Data is read in large chunks, complete records are parsed out of
+    the buffer and an incomplete record is carried over to the next
+    chunk. Suitable for pipes, sockets, stdin and compressed streams.
+    """
+
+    def __init__(self, stream, endianess=None, chunk_size=None,
+                 header_filter=None):
+        """Create reader that consumes stream chunk by chunk.
+
+        :param stream: data source, binary layer of text streams is used,
+            compressed data is decompressed transparently
+        :param str endianess: endianess string (see :mod:`struct`).
+        :param int chunk_size: number of bytes requested per read
+        :param header_filter: records rejected by filter are dropped
+            from the buffer without copying their data
+        :type header_filter: :class:`~vartools.common.HeaderFilter`
+        """
+        self._logger = logging.getLogger('ChunkedTraceReader')
+        self._stream = vtcz.open_decompressed(getattr(stream, 'buffer',
+                                                      stream))
+        self._chunk_size = chunk_size if chunk_size else DEFAULT_CHUNK_SIZE
+        endianess = endianess if endianess else vtc.DEFAULT_ENDIANESS
+        self._header_struct = struct.Struct(endianess + vtc.HEADER_FORMAT)
+        self._buffer = b''
+        self._position = 0
+        self._is_exhausted = False
+        self._header_filter = header_filter
+
+    def __iter__(self):
+        return self
+
+    def _skip(self, size):
+        """Drop bytes from the buffer, discard chunks if necessary."""
+        available = len(self._buffer) - self._position
+        while size > available and not self._is_exhausted:
+            size -= available
+            self._buffer = self._stream.read(self._chunk_size)
+            self._position = 0
+            if not self._buffer:
+                self._is_exhausted = True
+            available = len(self._buffer)
+        self._position += min(size, available)
+
+    def _fill(self, required_size):
+        """Read chunks until buffer holds required number of bytes.
+
+        :return: True if enough data is buffered.
+        """
+        while len(self._buffer) - self._position < required_size \
+                and not self._is_exhausted:
+            chunk = self._stream.read(self._chunk_size)
+            if not chunk:
+                self._is_exhausted = True
+                break
+            self._buffer = self._buffer[self._position:] + chunk
+            self._position = 0
+        return len(self._buffer) - self._position >= required_size
+
+    def __next__(self):
+        """Return next log entry parsed from the buffer."""
+        while True:
+            if not self._fill(vtc.HEADER_SIZE):
+                if self._position < len(self._buffer):
+                    self._logger.error('Reading stopped inside of header')
+                    self._position = len(self._buffer)
+                raise StopIteration
+            timestamp, size, message_id, type_id = \
+                self._header_struct.unpack_from(self._buffer, self._position)
+            if vtc.is_header_accepted(self._header_filter, timestamp,
+                                      message_id, type_id):
+                break
+            self._skip(vtc.HEADER_SIZE + size + vtc.padding_size(size))
+        record_size = vtc.HEADER_SIZE + size
+        if not self._fill(record_size + vtc.padding_size(size)) \
+                and not self._fill(record_size):
+            self._logger.error('Data read failed: got {0} expected {1}'.format(
+                len(self._buffer) - self._position - vtc.HEADER_SIZE, size))
+            self._position = len(self._buffer)
+            raise StopIteration
+        # filling may have moved data to the beginning of the buffer
+        data_start = self._position + vtc.HEADER_SIZE
+        data_end = data_start + size
+        data = self._buffer[data_start:data_end]
+        self._position = min(data_end + vtc.padding_size(size),
+                             len(self._buffer))
+        return vtc.TraceMessage(timestamp=timestamp, size=size,
+                                message_id=message_id, type_id=type_id,
+                                data=data, value=None)
+
+
+def is_regular_file(stream):
+    """Check if stream is backed by a regular file on disk."""
+    try:
+        return stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def is_compressed(stream):
+    """Check if stream contains compressed trace."""
+    return vtcz.detect_codec(getattr(stream, 'buffer', stream)) is not None
+
+
+def open_trace(stream, endianess=None, follow=False, header_filter=None,
+               **kwargs):
+    """Create the most efficient reader for given stream.
+
+    Regular files are memory mapped, other streams (pipes, sockets,
+    stdin) and compressed traces are read in large chunks with
+    :class:`ChunkedTraceReader`. Growing files are followed with
+    :class:`TraceReader`, keyword arguments are passed to its
+    constructor. Compressed traces can not be followed, see
+    :class:`TraceReader`.
+
+    :param io.RawIOBase stream: data source,
+    :param str endianess: endianess string (see :mod:`struct`).
+    :param bool follow: wait for new data at the end of stream
+    :param header_filter: records rejected by filter are skipped
+    :type header_filter: :class:`~vartools.common.HeaderFilter`
+    """
+    if follow:
+        return TraceReader(stream, endianess, follow=True,
+                           header_filter=header_filter, **kwargs)
+    if is_regular_file(stream) and not is_compressed(stream):
+        return MappedTraceReader(stream, endianess,
+                                 header_filter=header_filter)
+    return ChunkedTraceReader(stream, endianess, header_filter=header_filter)